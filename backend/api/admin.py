@@ -53,11 +53,6 @@ class RecipeAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         queryset = super().get_queryset(request)
 
-        # Аннотируем количество добавлений рецепта в избранное
-        queryset = queryset.annotate(
-            fav_count=Count('favorites', distinct=True)
-        )
-
         # Предзагружаем ингредиенты через связь RecipeIngredient и ingredient
         queryset = queryset.prefetch_related(
             Prefetch(
@@ -67,10 +62,6 @@ class RecipeAdmin(admin.ModelAdmin):
         )
         return queryset
 
-    @admin.display(description='В избранном')
-    def favorites_count(self, recipe):
-        return recipe.fav_count
-
     @admin.display(description='Ингредиенты')
     def display_ingredients(self, recipe):
         return mark_safe(
@@ -139,21 +130,13 @@ class HasSubscribersFilter(RelatedExistsFilter):
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = ('id', 'username', 'display_name', 'email',
-                    'display_avatar', 'recipe_count',
-                    'subscribe_count', 'subscription_count',
+                    'display_avatar', 'recipes_count',
+                    'subscriptions_count', 'subscribers_count',
                     )
     search_fields = ('first_name', 'last_name', 'username', 'email')
     list_filter = (
         HasRecipesFilter, HasSubscriptionsFilter, HasSubscribersFilter)
 
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        return queryset.annotate(
-            recipe_count=Count('recipes', distinct=True),
-            subscription_count=Count('authors', distinct=True),  # на него
-            subscribe_count=Count('followers', distinct=True)  # на других
-        )
-
     @admin.display(description='Фамилия Имя')
     def display_name(self, user):
         return f'{user.last_name} {user.first_name}'
@@ -165,18 +148,6 @@ class UserAdmin(admin.ModelAdmin):
                 f'<img src="{user.avatar.url}" width="50" height="50" />')
         return 'Нет аватарки'
 
-    @admin.display(description='Рецептов')
-    def recipe_count(self, user):
-        return user.recipe_count
-
-    @admin.display(description='Подписок')
-    def subscribe_count(self, user):
-        return user.subscribe_count
-
-    @admin.display(description='Подписчиков')
-    def subscription_count(self, user):
-        return user.subscription_count
-
 
 @admin.register(Subscription)
 class SubcriptionAdmin(admin.ModelAdmin):
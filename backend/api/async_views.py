@@ -0,0 +1,98 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from rest_framework.response import Response
+
+from .membership import get_membership
+
+
+class AsyncReadMixin:
+    """Чтение через корутины для работы под ASGI-сервером.
+
+    GET и HEAD действий из async_actions обрабатывает корутина:
+    аутентификация, права и фильтры работают как в DRF, а страница
+    выбирается асинхронным ORM, так что медленный запрос не занимает
+    воркер. Остальные методы того же маршрута обслуживает синхронный
+    вьюсет. ASYNC_READ_VIEWS=False оставляет только синхронный путь.
+    """
+
+    # Действие вьюсета -> имя корутины
+    async_actions = {}
+    # Множества api.membership, которые читает сериализатор
+    membership_models = ()
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        sync_view = super().as_view(actions, **initkwargs)
+        if (not settings.ASYNC_READ_VIEWS
+                or actions.get('get') not in cls.async_actions):
+            return sync_view
+        actions = {'head': actions['get'], **actions}
+        call_sync = sync_to_async(sync_view)
+
+        async def view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await call_sync(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.action_map = actions
+            for method, action in actions.items():
+                setattr(self, method, getattr(self, action))
+            return await self.adispatch(request, *args, **kwargs)
+
+        # csrf_exempt из Django 4.2 превратил бы корутину в функцию
+        view.csrf_exempt = True
+        view.cls, view.initkwargs, view.actions = cls, initkwargs, actions
+        return view
+
+    async def adispatch(self, request, *args, **kwargs):
+        """APIView.dispatch с корутиной вместо обработчика."""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            # Проверка токена обращается к БД
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            handler = getattr(self, self.async_actions[self.action])
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(
+            request, response, *args, **kwargs)
+        return self.response
+
+    async def afilter_queryset(self, queryset):
+        # Проверка параметров фильтра может читать БД (например, автора)
+        return await sync_to_async(self.filter_queryset)(queryset)
+
+    async def aprepare(self, objects):
+        """Читает заранее всё, что сериализатор иначе прочёл бы синхронно."""
+        if objects:
+            await get_membership(self.request).aload(*self.membership_models)
+
+    async def aget_object(self):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError,
+                ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        page = await self.paginator.apaginate_queryset(
+            queryset, request, view=self)
+        await self.aprepare(page)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        await self.aprepare([instance])
+        return Response(self.get_serializer(instance).data)
@@ -0,0 +1,39 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Favorite, Recipe, Subscription, User
+
+
+# (модель со счётчиком, поле счётчика, связанная модель, внешний ключ)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscriptions_count', Subscription, 'user'),
+    (User, 'subscribers_count', Subscription, 'author'),
+)
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно сдвигает счётчик прямо в БД, без чтения значения."""
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def count_subquery(related_model, foreign_key):
+    return Coalesce(
+        Subquery(
+            related_model.objects
+            .filter(**{foreign_key: OuterRef('pk')})
+            .order_by()
+            .values(foreign_key)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0
+    )
+
+
+def recount(model, field, related_model, foreign_key, queryset=None):
+    """Пересчитывает счётчик одним UPDATE для переданных объектов."""
+    queryset = model.objects.all() if queryset is None else queryset
+    return queryset.update(
+        **{field: count_subquery(related_model, foreign_key)})
@@ -0,0 +1,112 @@
+import heapq
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import FeedEntry, Recipe, Subscription, User
+
+
+def is_popular(subscribers_count):
+    return subscribers_count > settings.FEED_FANOUT_MAX_SUBSCRIBERS
+
+
+def fan_out(recipe_ids):
+    """Записывает новые рецепты в ленты подписчиков их авторов.
+
+    Рецепты популярных авторов пропускаются: они подмешиваются в ленту
+    при чтении (см. feed_page).
+    """
+    recipes = Recipe.objects.filter(
+        pk__in=recipe_ids,
+        author__subscribers_count__lte=settings.FEED_FANOUT_MAX_SUBSCRIBERS
+    ).values_list('pk', 'author_id', 'pub_date')
+    by_author = {}
+    for pk, author_id, pub_date in recipes:
+        by_author.setdefault(author_id, []).append((pk, pub_date))
+    for author_id, published in by_author.items():
+        followers = Subscription.objects.filter(
+            author_id=author_id).values_list('user_id', flat=True)
+        FeedEntry.objects.bulk_create(
+            (FeedEntry(user_id=user_id, recipe_id=pk, pub_date=pub_date)
+             for user_id in followers.iterator()
+             for pk, pub_date in published),
+            batch_size=1000, ignore_conflicts=True
+        )
+
+
+def backfill(user_id, author_id):
+    """Последние рецепты автора в ленту нового подписчика."""
+    author = User.objects.filter(pk=author_id).values_list(
+        'subscribers_count', flat=True).first()
+    if author is None or is_popular(author):
+        return
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=user_id, recipe_id=pk, pub_date=pub_date)
+         for pk, pub_date in Recipe.objects.filter(author_id=author_id)
+         .order_by('-pub_date', '-id')
+         .values_list('pk', 'pub_date')[:settings.FEED_BACKFILL_SIZE]),
+        ignore_conflicts=True
+    )
+
+
+def forget_author(user_id, author_id):
+    FeedEntry.objects.filter(
+        user_id=user_id, recipe__author_id=author_id).delete()
+
+
+def before(position, date_field, id_field):
+    """(pub_date, id) < position в виде, понятном индексу."""
+    pub_date, pk = position
+    return Q(**{f'{date_field}__lte': pub_date}) & (
+        Q(**{f'{date_field}__lt': pub_date})
+        | Q(**{date_field: pub_date, f'{id_field}__lt': pk})
+    )
+
+
+def parse_position(position):
+    """Позиция курсора [дата ISO, id] или None, если она испорчена."""
+    if position is None:
+        return None
+    pub_date, pk = position
+    pub_date = isinstance(pub_date, str) and parse_datetime(pub_date)
+    if not pub_date or not isinstance(pk, int):
+        raise ValueError(position)
+    return pub_date, pk
+
+
+def feed_page(user, position, limit):
+    """id рецептов страницы ленты и позиция следующей страницы.
+
+    Разложенные записи и рецепты каждого популярного автора читаются
+    отдельными запросами по индексам, не больше limit + 1 строк каждый,
+    и сливаются по убыванию (pub_date, id).
+    """
+    entries = FeedEntry.objects.filter(user=user).order_by(
+        '-pub_date', '-recipe_id').values_list('pub_date', 'recipe_id')
+    if position is not None:
+        entries = entries.filter(before(position, 'pub_date', 'recipe_id'))
+    streams = [entries[:limit + 1]]
+    for author_id in Subscription.objects.filter(
+        user=user,
+        author__subscribers_count__gt=settings.FEED_FANOUT_MAX_SUBSCRIBERS
+    ).values_list('author_id', flat=True):
+        recipes = Recipe.objects.filter(author_id=author_id).order_by(
+            '-pub_date', '-id').values_list('pub_date', 'id')
+        if position is not None:
+            recipes = recipes.filter(before(position, 'pub_date', 'id'))
+        streams.append(recipes[:limit + 1])
+    page = []
+    seen = set()
+    # Рецепт автора, ставшего популярным, может быть в обоих списках
+    for pub_date, pk in heapq.merge(*streams, reverse=True):
+        if pk not in seen:
+            seen.add(pk)
+            page.append((pub_date, pk))
+            if len(page) > limit:
+                break
+    next_position = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_position = [page[-1][0].isoformat(), page[-1][1]]
+    return [pk for _, pk in page], next_position
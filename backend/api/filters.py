@@ -1,5 +1,30 @@
+from django.conf import settings
+from django.db.models import Count
 from django_filters import rest_framework as filters
-from api.models import Recipe
+from api.membership import get_membership, member_exists
+from api.models import Favorite, Recipe, RecipeIngredient, ShoppingCart
+from api.search import search_recipes
+
+
+# ?ordering= -> ключ сортировки; он же ключ курсора (см. RecipeViewSet)
+RECIPE_ORDERINGS = {
+    'popular': ('-popularity_score', 'id'),
+    'trending': ('-trending_score', 'id'),
+}
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    """Список чисел через запятую: ?ingredients=1,5,9."""
+
+
+def recipes_with_ingredients(ids):
+    """Подзапрос id рецептов, содержащих любой из ингредиентов.
+
+    Читает только индекс (ingredient, recipe): по списку рецептов
+    на каждый ингредиент, без соединения с таблицей рецептов.
+    """
+    return RecipeIngredient.objects.filter(
+        ingredient_id__in=ids).order_by().values('recipe_id')
 
 
 class RecipeFilter(filters.FilterSet):
@@ -7,23 +32,51 @@ class RecipeFilter(filters.FilterSet):
         method='filter_is_in_shopping_cart')
     author = filters.NumberFilter(field_name='author__id')
     is_favorited = filters.NumberFilter(method='filter_is_favorited')
+    search = filters.CharFilter(method='filter_search')
+    ingredients = NumberInFilter(method='filter_ingredients')
+    exclude_ingredients = NumberInFilter(method='filter_exclude_ingredients')
+    # Объявлен последним: явная сортировка важнее ранжирования поиска
+    ordering = filters.ChoiceFilter(
+        choices=[(key, key) for key in RECIPE_ORDERINGS],
+        method='filter_ordering'
+    )
 
     class Meta:
         model = Recipe
-        fields = ('author', 'is_in_shopping_cart', 'is_favorited')
+        fields = ('author', 'is_in_shopping_cart', 'is_favorited', 'search',
+                  'ingredients', 'exclude_ingredients', 'ordering')
 
-    def filter_is_in_shopping_cart(self, recipes_qs, name, value):
-        user = self.request.user
-        if not user.is_authenticated:
-            return recipes_qs.none() if value else recipes_qs
+    def filter_membership(self, recipes_qs, model, value):
+        ids = get_membership(self.request).get(model)
+        # Длинный список id раздул бы текст и план запроса: его заменяет
+        # подзапрос по индексу (user, recipe)
+        if len(ids) > settings.MEMBERSHIP_IN_LIST_LIMIT:
+            exists = member_exists(model, self.request.user)
+            return recipes_qs.filter(exists if value else ~exists)
+        # Короткое множество id берётся из кеша членства, без соединений
         if value:
-            return recipes_qs.filter(in_carts__user=user)
-        return recipes_qs.exclude(in_carts__user=user)
+            return recipes_qs.filter(pk__in=ids)
+        return recipes_qs.exclude(pk__in=ids) if ids else recipes_qs
+
+    def filter_is_in_shopping_cart(self, recipes_qs, name, value):
+        return self.filter_membership(recipes_qs, ShoppingCart, value)
 
     def filter_is_favorited(self, recipes_qs, name, value):
-        user = self.request.user
-        if not user.is_authenticated:
-            return recipes_qs.none() if value else recipes_qs
-        if value:
-            return recipes_qs.filter(favorites__user=user)
-        return recipes_qs.exclude(favorites__user=user)
+        return self.filter_membership(recipes_qs, Favorite, value)
+
+    def filter_search(self, recipes_qs, name, value):
+        return search_recipes(recipes_qs, value)
+
+    def filter_ingredients(self, recipes_qs, name, value):
+        # Пересечение списков: рецепт встретился у каждого из ингредиентов
+        ids = {int(pk) for pk in value}
+        return recipes_qs.filter(pk__in=recipes_with_ingredients(ids).annotate(
+            found=Count('ingredient_id', distinct=True)
+        ).filter(found=len(ids)).values('recipe_id'))
+
+    def filter_exclude_ingredients(self, recipes_qs, name, value):
+        return recipes_qs.exclude(pk__in=recipes_with_ingredients(
+            {int(pk) for pk in value}))
+
+    def filter_ordering(self, recipes_qs, name, value):
+        return recipes_qs.order_by(*RECIPE_ORDERINGS[value])
@@ -0,0 +1,135 @@
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .response_cache import bump_recipes_version
+
+
+# Наибольшие ширина и высота каждого варианта
+SIZES = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1200, 1200),
+}
+# Формат: (имя в Pillow, расширение, параметры сохранения)
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'fallback': ('JPEG', 'jpg', {'quality': 85, 'optimize': True,
+                                 'progressive': True}),
+}
+# Поле с изображением -> поле со сведениями о его вариантах
+VARIANT_FIELDS = {
+    'image': 'image_variants',
+    'avatar': 'avatar_variants',
+}
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_VARIANTS_WORKERS,
+    thread_name_prefix='image-variants'
+)
+
+
+def variant_name(source_name, size, extension):
+    stem = posixpath.splitext(source_name)[0]
+    return posixpath.join('variants', stem, f'{size}.{extension}')
+
+
+def flatten(image):
+    """RGB без прозрачности: JPEG её не поддерживает."""
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def build_variants(field_file):
+    """Сохраняет все варианты изображения и возвращает их имена."""
+    storage = field_file.storage
+    with storage.open(field_file.name) as source:
+        original = flatten(Image.open(source))
+    variants = {'source': field_file.name}
+    for size, box in SIZES.items():
+        image = original.copy()
+        image.thumbnail(box, Image.LANCZOS)
+        variants[size] = {}
+        for key, (pillow_format, extension, options) in FORMATS.items():
+            buffer = BytesIO()
+            image.save(buffer, pillow_format, **options)
+            variants[size][key] = storage.save(
+                variant_name(field_file.name, size, extension),
+                ContentFile(buffer.getvalue()))
+    return variants
+
+
+def generate_variants(model, pk, field):
+    """Строит варианты в фоновом потоке и записывает их в объект."""
+    close_old_connections()
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is None or not getattr(instance, field):
+            return
+        field_file = getattr(instance, field)
+        # Испорченный, обрезанный или слишком большой файл: вариантов
+        # нет, клиенты получают оригинал
+        try:
+            variants = build_variants(field_file)
+        except (OSError, ValueError, SyntaxError,
+                Image.DecompressionBombError):
+            logger.exception('Не удалось построить варианты %s',
+                             field_file.name)
+            return
+        # Изображение могли заменить, пока строились варианты
+        if model.objects.filter(pk=pk, **{field: field_file.name}).update(
+                **{VARIANT_FIELDS[field]: variants}):
+            # update() не шлёт сигналов, а ссылки видны в кешированных ответах
+            bump_recipes_version()
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(instance, field):
+    """Ставит построение вариантов в очередь, если изображение новое."""
+    field_file = getattr(instance, field)
+    variants = getattr(instance, VARIANT_FIELDS[field])
+    if not field_file:
+        if variants:
+            type(instance).objects.filter(pk=instance.pk).update(
+                **{VARIANT_FIELDS[field]: {}})
+        return
+    if variants.get('source') == field_file.name:
+        return
+    transaction.on_commit(partial(
+        executor.submit, generate_variants, type(instance), instance.pk,
+        field))
+
+
+def variant_urls(request, field_file, variants):
+    """URL вариантов по размерам; пока их нет — ссылка на оригинал."""
+    if not field_file:
+        return None
+
+    def absolute(name):
+        url = field_file.storage.url(name)
+        return request.build_absolute_uri(url) if request else url
+
+    ready = variants.get('source') == field_file.name
+    return {
+        size: (
+            {key: absolute(variants[size][key]) for key in FORMATS}
+            if ready else
+            {'webp': None, 'fallback': absolute(field_file.name)}
+        )
+        for size in SIZES
+    }
@@ -0,0 +1,204 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from statistics import quantiles
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Сервер: аргументы gunicorn и переменные окружения
+SERVERS = {
+    'wsgi': (['foodgram.wsgi:application'],
+             {'ASYNC_READ_VIEWS': 'false'}),
+    'asgi': (['foodgram.asgi:application',
+              '--worker-class', 'uvicorn_worker.UvicornWorker'],
+             {'ASYNC_READ_VIEWS': 'true'}),
+}
+DEFAULT_PATHS = (
+    '/api/recipes/?limit=6',
+    '/api/recipes/?cursor=&limit=6&ordering=popular',
+    '/api/ingredients/?name=мук',
+)
+
+
+def process_tree(pid):
+    """pid процесса и всех его потомков."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as file:
+                stat = file.read()
+        except OSError:
+            continue
+        # Имя процесса в скобках может содержать пробелы
+        parent = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(parent, []).append(int(entry))
+    tree, queue = [], [pid]
+    while queue:
+        tree.append(queue.pop())
+        queue.extend(children.get(tree[-1], ()))
+    return tree
+
+
+def rss(pid):
+    """Resident set size процесса в МБ; 0, если процесс завершился."""
+    try:
+        with open(f'/proc/{pid}/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+async def fetch(port, path, headers):
+    """Один GET без keep-alive: sync-воркер gunicorn его не держит."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write((
+            f'GET {quote(path, safe="/?=&")} HTTP/1.1\r\n'
+            f'Host: localhost\r\n{headers}Connection: close\r\n\r\n'
+        ).encode())
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+class Command(BaseCommand):
+    help = ('Сравнение WSGI (sync-воркеры gunicorn) и ASGI (воркеры '
+            'uvicorn) при одинаковом бюджете памяти: число воркеров '
+            'подбирается по замеренному размеру воркера, затем нагрузка '
+            'подаётся с разной параллельностью. Память читается из /proc, '
+            'поэтому команда работает только в Linux')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--memory', type=int, default=512,
+            help='Бюджет памяти на сервер с воркерами, МБ'
+        )
+        parser.add_argument(
+            '--concurrency', default='8,32,128',
+            help='Уровни параллельности через запятую'
+        )
+        parser.add_argument(
+            '--duration', type=float, default=10,
+            help='Секунд нагрузки на каждый уровень'
+        )
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='Запрашиваемый путь; можно указать несколько раз'
+        )
+        parser.add_argument(
+            '--token', help='Токен пользователя: без него ответы '
+                            'анонимам берутся из кеша ответов'
+        )
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--servers', default=','.join(SERVERS),
+            help='Какие серверы сравнивать'
+        )
+
+    def handle(self, *args, memory, concurrency, duration, paths, token,
+               port, servers, **kwargs):
+        if not os.path.isdir('/proc'):
+            raise CommandError('Нужен Linux: память читается из /proc')
+        self.port = port
+        self.paths = paths or DEFAULT_PATHS
+        self.headers = f'Authorization: Token {token}\r\n' if token else ''
+        levels = [int(level) for level in concurrency.split(',')]
+        for server in servers.split(','):
+            if server not in SERVERS:
+                raise CommandError(f'Неизвестный сервер {server}')
+            workers = self.size_workers(server, memory)
+            self.stdout.write(f'\n{server}: воркеров {workers}')
+            self.stdout.write(
+                'параллельно  запросов/с  p50, мс  p99, мс  ошибок  '
+                'память, МБ')
+            with self.running(server, workers) as process:
+                for level in levels:
+                    result = asyncio.run(
+                        self.load(process.pid, level, duration))
+                    self.stdout.write(
+                        '{:>11}  {:>10.0f}  {:>7.1f}  {:>7.1f}  {:>6}  '
+                        '{:>10.0f}'.format(level, *result))
+
+    def size_workers(self, server, memory):
+        """Сколько воркеров помещается в бюджет после прогрева одного."""
+        with self.running(server, 1) as process:
+            asyncio.run(self.load(process.pid, 8, 2))
+            tree = process_tree(process.pid)
+            master = rss(process.pid)
+            worker = sum(map(rss, tree)) - master
+        workers = int((memory - master) // worker)
+        self.stdout.write(
+            f'{server}: мастер {master:.0f} МБ, воркер {worker:.0f} МБ')
+        if workers < 1:
+            raise CommandError(f'В {memory} МБ не помещается ни один воркер')
+        return workers
+
+    @contextmanager
+    def running(self, server, workers):
+        command, env = SERVERS[server]
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', *command,
+             '--bind', f'127.0.0.1:{self.port}',
+             '--workers', str(workers), '--log-level', 'warning'],
+            cwd=settings.BASE_DIR, env={**os.environ, **env}
+        )
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    asyncio.run(fetch(self.port, '/api/', ''))
+                    break
+                except OSError:
+                    if (time.monotonic() > deadline
+                            or process.poll() is not None):
+                        raise CommandError(f'{server} не запустился')
+                    time.sleep(0.2)
+            yield process
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=60)
+
+    async def load(self, pid, concurrency, duration):
+        """Запросы/с, p50 и p99 в мс, ошибки и пик памяти дерева pid."""
+        latencies, errors, peak = [], 0, 0.0
+        deadline = time.monotonic() + duration
+
+        async def client(number):
+            nonlocal errors
+            while time.monotonic() < deadline:
+                path = self.paths[(number + len(latencies))
+                                  % len(self.paths)]
+                started = time.monotonic()
+                try:
+                    ok = await fetch(self.port, path, self.headers) == 200
+                except (OSError, ValueError, IndexError):
+                    ok = False
+                latencies.append(time.monotonic() - started)
+                errors += not ok
+
+        async def sample():
+            nonlocal peak
+            while time.monotonic() < deadline:
+                peak = max(peak, sum(map(rss, process_tree(pid))))
+                await asyncio.sleep(0.5)
+
+        started = time.monotonic()
+        await asyncio.gather(
+            sample(), *(client(number) for number in range(concurrency)))
+        elapsed = time.monotonic() - started
+        p50, p99 = (quantiles(latencies, n=100)[i] * 1000 for i in (49, 98))
+        return len(latencies) / elapsed, p50, p99, errors, peak
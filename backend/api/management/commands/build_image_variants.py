@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from api.images import VARIANT_FIELDS, build_variants
+from api.models import Recipe, User
+from api.response_cache import bump_recipes_version
+
+
+class Command(BaseCommand):
+    help = 'Построение недостающих вариантов изображений рецептов и аватаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Перестроить варианты, даже если они уже есть'
+        )
+
+    def handle(self, *args, force, **kwargs):
+        total = 0
+        for model, field in ((Recipe, 'image'), (User, 'avatar')):
+            variants_field = VARIANT_FIELDS[field]
+            built = failed = 0
+            objects = (model.objects.exclude(**{field: ''})
+                       .exclude(**{f'{field}__isnull': True})
+                       .only('pk', field, variants_field))
+            for instance in objects.iterator():
+                field_file = getattr(instance, field)
+                variants = getattr(instance, variants_field)
+                if not force and variants.get('source') == field_file.name:
+                    continue
+                try:
+                    variants = build_variants(field_file)
+                except (OSError, ValueError) as error:
+                    failed += 1
+                    self.stderr.write(self.style.ERROR(
+                        f'{field_file.name}: {error}'))
+                    continue
+                model.objects.filter(pk=instance.pk).update(
+                    **{variants_field: variants})
+                built += 1
+            total += built
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: построено {built}, '
+                f'ошибок {failed}'
+            ))
+        if total:
+            bump_recipes_version()
@@ -0,0 +1,77 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from api.models import RecipeSimilarity, RecipeSimilarityBuild
+from api.similar import (
+    INTERACTIONS, column_norms, columns_of_users, interaction_matrix,
+    store_neighbours
+)
+
+
+class Command(BaseCommand):
+    help = ('Расчёт похожих рецептов по совместному добавлению в избранное '
+            'и корзину. По умолчанию пересчитываются только рецепты '
+            'пользователей, добавивших что-то после прошлого запуска.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать все рецепты (учитывает и удалённые связи)'
+        )
+        parser.add_argument(
+            '--top-k', type=int, default=settings.SIMILAR_RECIPES_TOP_K,
+            help='Сколько соседей хранить для рецепта'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='Рецептов в одной транзакции'
+        )
+
+    def handle(self, *args, full, top_k, batch_size, **kwargs):
+        started = time.monotonic()
+        previous = RecipeSimilarityBuild.objects.order_by('-pk').first()
+        full = full or previous is None
+        # Границы фиксируем до чтения связей: добавленное позже попадёт
+        # в следующий запуск
+        marks = [model.objects.aggregate(last=Max('pk'))['last'] or 0
+                 for model, _ in INTERACTIONS]
+        matrix, user_ids, recipe_ids = interaction_matrix()
+        if full:
+            columns = np.arange(len(recipe_ids))
+        else:
+            users = set()
+            for (model, _), last in zip(INTERACTIONS, (
+                    previous.last_favorite_id,
+                    previous.last_shopping_cart_id)):
+                users.update(model.objects.filter(pk__gt=last).values_list(
+                    'user_id', flat=True))
+            columns = columns_of_users(matrix, user_ids, users)
+        self.stdout.write(
+            f'Связей {matrix.nnz}, рецептов {len(recipe_ids)}, '
+            f'пересчитываем {len(columns)}'
+        )
+
+        norms = column_norms(matrix)
+        stored = 0
+        for start in range(0, len(columns), batch_size):
+            stored += store_neighbours(
+                matrix, norms, recipe_ids, columns[start:start + batch_size],
+                top_k)
+        if full:
+            # Рецепты, у которых связей не осталось
+            stale = set(RecipeSimilarity.objects.values_list(
+                'recipe_id', flat=True).distinct()) - set(recipe_ids.tolist())
+            RecipeSimilarity.objects.filter(recipe_id__in=stale).delete()
+
+        RecipeSimilarityBuild.objects.create(
+            last_favorite_id=marks[0], last_shopping_cart_id=marks[1],
+            full=full, recipes=len(columns)
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Сохранено соседей: {stored}, рецептов: {len(columns)} '
+            f'за {time.monotonic() - started:.1f} с.'
+        ))
@@ -0,0 +1,78 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.images import SIZES
+from api.models import Recipe, User
+
+
+# Каталоги, в которые пишут модели и построение вариантов
+MEDIA_DIRS = ('recipe/images', 'users/images', 'variants')
+
+
+def walk(storage, path):
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield posixpath.join(path, name)
+    for directory in directories:
+        yield from walk(storage, posixpath.join(path, directory))
+
+
+def variant_names(variants):
+    return (name for size in SIZES
+            for name in variants.get(size, {}).values())
+
+
+def referenced_names():
+    names = set()
+    fields = ((Recipe, 'image', 'image_variants'),
+              (User, 'avatar', 'avatar_variants'))
+    for model, field, variants_field in fields:
+        for name, variants in (model.objects
+                               .values_list(field, variants_field)
+                               .iterator()):
+            if name:
+                names.add(name)
+            names.update(variant_names(variants or {}))
+    return names
+
+
+class Command(BaseCommand):
+    help = 'Удаление файлов медиа, на которые не ссылаются рецепты и аватары'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено'
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=60,
+            help='Не трогать файлы моложе стольких минут: их ещё могут '
+                 'сохранять незавершённые транзакции'
+        )
+
+    def handle(self, *args, dry_run, min_age, **kwargs):
+        storage = default_storage
+        referenced = referenced_names()
+        threshold = timezone.now() - timedelta(minutes=min_age)
+        removed = freed = 0
+        for directory in MEDIA_DIRS:
+            if not storage.exists(directory):
+                continue
+            for name in walk(storage, directory):
+                if (name in referenced
+                        or storage.get_modified_time(name) > threshold):
+                    continue
+                removed += 1
+                freed += storage.size(name)
+                if dry_run:
+                    self.stdout.write(name)
+                else:
+                    storage.delete(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Будет удалено" if dry_run else "Удалено"} файлов: '
+            f'{removed}, {freed / 1024 / 1024:.1f} МБ'
+        ))
@@ -1,33 +1,157 @@
 import json
 import os
-from django.core.management.base import BaseCommand
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
 from api.models import Ingredient
+from api.response_cache import bump_recipes_version
+from api.search import ingredient_index
+
+
+def iter_json_array(file, chunk_size=1 << 16):
+    """Элементы JSON-массива по одному, не читая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started and buffer:
+            if buffer[0] != '[':
+                raise ValueError('ожидается JSON-массив')
+            buffer = buffer[1:].lstrip()
+            started = True
+        if started and buffer[:1] == ',':
+            buffer = buffer[1:].lstrip()
+        if started and buffer[:1] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except ValueError:
+            # Элемент прочитан не полностью: дочитываем файл
+            if eof:
+                raise
+            data = file.read(chunk_size)
+            eof = not data
+            buffer += data
+            continue
+        buffer = buffer[end:]
+        yield item
+
+
+def clean(value):
+    return ' '.join(str(value).split())
+
+
+def fold(name, unit):
+    return name.casefold(), unit.casefold()
 
 
 class Command(BaseCommand):
-    help = 'Загрузка ингредиентов из ingredients.json'
+    help = ('Синхронизация ингредиентов с JSON-файлом: новые добавляются, '
+            'изменённые (регистр, пробелы) обновляются, повторный запуск '
+            'ничего не меняет')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            default=os.path.join('data', 'ingredients.json'),
+            help='Путь к JSON-файлу (по умолчанию data/ingredients.json)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Ингредиентов в одной транзакции'
+        )
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='Удалить ингредиенты, которых нет в файле '
+                 '(кроме используемых в рецептах)'
+        )
+
+    def handle(self, *args, path, batch_size, prune, **kwargs):
+        if not os.path.exists(path):
+            raise CommandError(f'Файл "{path}" не найден')
+        started = time.monotonic()
+        # Ключ -> id; сопоставление без учёта регистра нужно, чтобы
+        # исправление написания обновляло запись, а не плодило новую
+        self.exact = {}
+        self.folded = {}
+        for pk, name, unit in Ingredient.objects.values_list(
+                'pk', 'name', 'measurement_unit').iterator():
+            self.exact[(name, unit)] = pk
+            self.folded.setdefault(fold(name, unit), pk)
+        self.matched = set()
+        self.seen = set()
+        self.counts = dict.fromkeys(('inserted', 'updated', 'unchanged'), 0)
 
-    def handle(self, *args, **kwargs):
         try:
-            path = os.path.join('data', 'ingredients.json')
             with open(path, encoding='utf-8') as file:
-                Ingredient.objects.bulk_create(
-                    (Ingredient(**item) for item in json.load(file)),
-                    ignore_conflicts=True
-                )
-
-            self.stdout.write(
-                self.style.SUCCESS(
-                    # Предполагается, что метод вызывается разово
-                    # при первом запуске проекта => БД первоначально пуста
-                    (f'{Ingredient.objects.count()}'
-                     ' ингредиентов успешно загружено.')
-                )
-            )
-        except Exception as e:
-            self.stderr.write(
-                self.style.ERROR(
-                    'Произошла непредвиденная ошибка при обработке файла '
-                    f'"{path}": {e}'
-                )
+                items = iter_json_array(file)
+                while batch := list(islice(items, batch_size)):
+                    self.sync_batch(batch)
+        except (ValueError, KeyError, TypeError) as error:
+            raise CommandError(
+                f'Ошибка в файле "{path}": {error}. Уже обработано: '
+                + self.format_counts()
             )
+
+        pruned = kept = 0
+        if prune:
+            stale = Ingredient.objects.filter(
+                pk__in=set(self.exact.values()) - self.matched)
+            # Удаление используемого ингредиента удалило бы его из рецептов
+            kept = stale.filter(
+                recipe_ingredients__isnull=False).distinct().count()
+            pruned, _ = stale.filter(recipe_ingredients__isnull=True).delete()
+
+        # Массовые операции не шлют сигналы: сбрасываем кеши вручную
+        if self.counts['inserted'] or self.counts['updated'] or pruned:
+            ingredient_index.invalidate()
+            ingredient_index.rebuild()
+        if self.counts['updated']:
+            bump_recipes_version()
+
+        message = self.format_counts()
+        if prune:
+            message += f', удалено {pruned}'
+            if kept:
+                message += f', оставлено используемых в рецептах {kept}'
+        self.stdout.write(self.style.SUCCESS(
+            f'{message} за {time.monotonic() - started:.1f} с.'))
+
+    def format_counts(self):
+        return ('добавлено {inserted}, обновлено {updated}, '
+                'без изменений {unchanged}'.format(**self.counts))
+
+    def sync_batch(self, batch):
+        created, updated = [], []
+        for item in batch:
+            name = clean(item['name'])
+            unit = clean(item['measurement_unit'])
+            if not name or not unit:
+                raise ValueError(f'пустое название или единица: {item}')
+            if (name, unit) in self.seen:
+                continue
+            self.seen.add((name, unit))
+            pk = self.exact.get((name, unit))
+            if pk is not None and pk not in self.matched:
+                self.counts['unchanged'] += 1
+                self.matched.add(pk)
+                continue
+            pk = self.folded.get(fold(name, unit))
+            if pk is not None and pk not in self.matched:
+                updated.append(
+                    Ingredient(pk=pk, name=name, measurement_unit=unit))
+                self.matched.add(pk)
+            else:
+                created.append(Ingredient(name=name, measurement_unit=unit))
+        with transaction.atomic():
+            Ingredient.objects.bulk_update(
+                updated, ('name', 'measurement_unit'))
+            # Конфликт возможен только с параллельным запуском
+            Ingredient.objects.bulk_create(created, ignore_conflicts=True)
+        self.counts['updated'] += len(updated)
+        self.counts['inserted'] += len(created)
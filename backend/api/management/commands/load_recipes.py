@@ -0,0 +1,235 @@
+import base64
+import binascii
+import json
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from PIL import Image
+
+from api.counters import recount
+from api.feed import fan_out
+from api.management.workers import init_worker
+from api.models import (
+    Ingredient, Recipe, RecipeImport, RecipeIngredient, User
+)
+from api.pantry import pantry_index
+from api.response_cache import bump_recipes_version
+
+
+UPLOAD_TO = Recipe._meta.get_field('image').upload_to
+
+
+def store_image(value, base_dir):
+    """Декодирует и сохраняет изображение; выполняется в пуле процессов.
+
+    Возвращает (имя файла, None) или (None, текст ошибки).
+    """
+    try:
+        if value.startswith('data:'):
+            data = base64.b64decode(value.split(';base64,', 1)[1])
+        else:
+            with open(os.path.join(base_dir, value), 'rb') as file:
+                data = file.read()
+        with Image.open(BytesIO(data)) as image:
+            extension = image.format.lower()
+            image.verify()
+    except (OSError, ValueError, IndexError, binascii.Error) as error:
+        return None, f'изображение: {error}'
+    name = default_storage.save(
+        f'{UPLOAD_TO}{uuid.uuid4().hex}.{extension}', ContentFile(data))
+    return name, None
+
+
+class Command(BaseCommand):
+    help = ('Загрузка рецептов из JSONL-файла: одна строка — один рецепт '
+            '{"author", "name", "text", "cooking_time", "image", '
+            '"ingredients": [{"name", "measurement_unit", "amount"}]}')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к JSONL-файлу')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Рецептов в одной транзакции'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Процессов для декодирования изображений'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Имя сохранённой в БД позиции загрузки '
+                 '(по умолчанию абсолютный путь к файлу)'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Игнорировать сохранённую позицию и начать сначала'
+        )
+
+    def handle(self, *args, path, batch_size, workers, checkpoint, restart,
+               **kwargs):
+        if not os.path.exists(path):
+            raise CommandError(f'Файл "{path}" не найден')
+        self.progress, _ = RecipeImport.objects.get_or_create(
+            source=checkpoint or os.path.abspath(path))
+        if restart:
+            self.progress.last_line = 0
+        start_line = self.progress.last_line
+        if start_line:
+            self.stdout.write(f'Продолжаем со строки {start_line + 1}')
+
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        self.workers = workers
+        self.authors = {}
+        self.ingredients = {}
+        for pk, name, unit in Ingredient.objects.values_list(
+                'pk', 'name', 'measurement_unit').iterator():
+            self.ingredients[(name.lower(), unit)] = pk
+            self.ingredients.setdefault((name.lower(), None), pk)
+
+        loaded = failed = 0
+        author_ids = set()
+        started = time.monotonic()
+        # spawn, а не fork: дочерние процессы не должны унаследовать
+        # открытое соединение с БД
+        pool = ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker,
+            initargs=(settings.MEDIA_ROOT,),
+            mp_context=multiprocessing.get_context('spawn'))
+        with open(path, encoding='utf-8') as file, pool:
+            lines = islice(enumerate(file, start=1), start_line, None)
+            while True:
+                chunk = list(islice(lines, batch_size))
+                if not chunk:
+                    break
+                created, errors = self.load_chunk(chunk, pool)
+                loaded += len(created)
+                failed += len(errors)
+                author_ids.update(recipe.author_id for recipe in created)
+                for number, error in errors:
+                    self.stderr.write(f'Строка {number}: {error}')
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Строка {chunk[-1][0]}: загружено {loaded}, '
+                    f'ошибок {failed}, {loaded / elapsed:.0f} рецептов/с'
+                )
+
+        # bulk_create не шлёт сигналов: пересчитываем затронутое вручную
+        recount(User, 'recipes_count', Recipe, 'author',
+                User.objects.filter(pk__in=author_ids))
+        bump_recipes_version()
+        pantry_index.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {loaded} рецептов, ошибок {failed}. Уменьшенные '
+            'копии изображений построит команда build_image_variants.'
+        ))
+
+    def resolve_authors(self, keys):
+        missing = keys - self.authors.keys()
+        if missing:
+            for pk, email, username in User.objects.filter(
+                    Q(email__in=missing) | Q(username__in=missing)
+            ).values_list('pk', 'email', 'username'):
+                self.authors[email] = self.authors[username] = pk
+
+    @staticmethod
+    def parse_text(record, field):
+        value = record[field]
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f'{field}: ожидается непустая строка')
+        max_length = Recipe._meta.get_field(field).max_length
+        if max_length and len(value) > max_length:
+            raise ValueError(f'{field}: длиннее {max_length} символов')
+        return value
+
+    def parse(self, record):
+        author_id = self.authors.get(str(record['author']))
+        if author_id is None:
+            raise ValueError(f'автор {record["author"]} не найден')
+        cooking_time = int(record['cooking_time'])
+        if cooking_time < 1:
+            raise ValueError('время приготовления меньше 1')
+        ingredients = {}
+        for item in record['ingredients']:
+            key = (item['name'].lower(), item.get('measurement_unit'))
+            if key not in self.ingredients:
+                raise ValueError(f'ингредиент {item["name"]} не найден')
+            amount = int(item['amount'])
+            if amount < 1:
+                raise ValueError(f'количество {item["name"]} меньше 1')
+            ingredients[self.ingredients[key]] = amount
+        if not ingredients:
+            raise ValueError('нет ингредиентов')
+        recipe = Recipe(author_id=author_id,
+                        name=self.parse_text(record, 'name'),
+                        text=self.parse_text(record, 'text'),
+                        cooking_time=cooking_time)
+        image = record['image']
+        if not isinstance(image, str) or not image:
+            raise ValueError('изображение: ожидается путь или data URI')
+        return recipe, ingredients, image
+
+    def load_chunk(self, chunk, pool):
+        errors = []
+        records = []
+        for number, line in chunk:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                errors.append((number, f'JSON: {error}'))
+                continue
+            if not isinstance(record, dict):
+                errors.append((number, 'ожидается объект'))
+                continue
+            records.append((number, record))
+        self.resolve_authors({str(record.get('author'))
+                              for _, record in records})
+        parsed = []
+        for number, record in records:
+            try:
+                parsed.append((number, *self.parse(record)))
+            except (KeyError, TypeError, ValueError) as error:
+                errors.append((number, str(error)))
+
+        stored = pool.map(
+            store_image, (image for *_, image in parsed),
+            [self.base_dir] * len(parsed),
+            chunksize=max(1, len(parsed) // (4 * self.workers))
+        )
+        recipes, compositions = [], []
+        for (number, recipe, ingredients, _), (name, error) in zip(
+                parsed, stored):
+            if error:
+                errors.append((number, error))
+                continue
+            recipe.image = name
+            recipes.append(recipe)
+            compositions.append(ingredients)
+
+        # Рецепты, ленты и позиция в файле сохраняются вместе: после
+        # сбоя порция либо загружена целиком, либо загружается заново
+        with transaction.atomic():
+            Recipe.objects.bulk_create(recipes)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe_id=recipe.pk, ingredient_id=pk,
+                                 amount=amount)
+                for recipe, ingredients in zip(recipes, compositions)
+                for pk, amount in ingredients.items()
+            )
+            # bulk_create не шлёт сигналов: раскладываем по лентам сами
+            fan_out([recipe.pk for recipe in recipes])
+            self.progress.last_line = chunk[-1][0]
+            self.progress.save()
+        return recipes, sorted(errors)
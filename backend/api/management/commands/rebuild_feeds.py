@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from api.feed import backfill
+from api.models import FeedEntry, Subscription
+
+
+class Command(BaseCommand):
+    help = ('Заполнение лент подписок последними рецептами авторов: '
+            'после первого развёртывания и после того, как популярный '
+            'автор снова стал обычным')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Сначала удалить все записи лент'
+        )
+
+    def handle(self, *args, clear, **kwargs):
+        if clear:
+            FeedEntry.objects.all().delete()
+        subscriptions = Subscription.objects.order_by('pk').values_list(
+            'user_id', 'author_id')
+        for number, (user_id, author_id) in enumerate(
+                subscriptions.iterator(), start=1):
+            backfill(user_id, author_id)
+            if number % 1000 == 0:
+                self.stdout.write(f'Обработано подписок: {number}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {FeedEntry.objects.count()}'))
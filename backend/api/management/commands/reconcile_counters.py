@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.counters import COUNTERS, recount
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт хранимых счётчиков избранного, рецептов и подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько объектов пересчитывать за одну транзакцию'
+        )
+
+    def handle(self, *args, batch_size, **kwargs):
+        for model, field, related_model, foreign_key in COUNTERS:
+            pks = model.objects.order_by('pk').values_list('pk', flat=True)
+            updated = 0
+            last_pk = 0
+            while True:
+                batch = list(pks.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1]
+                with transaction.atomic():
+                    updated += recount(
+                        model, field, related_model, foreign_key,
+                        model.objects.filter(pk__in=batch)
+                    )
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}.{field}: '
+                f'пересчитано {updated}'
+            ))
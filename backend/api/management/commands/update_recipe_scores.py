@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.response_cache import bump_recipes_version
+from api.scores import compute_scores, load_events, store_scores
+
+
+class Command(BaseCommand):
+    help = ('Пересчёт оценок для ?ordering=popular и ?ordering=trending '
+            'по добавлениям в избранное и корзину; запускать по расписанию')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Рецептов в одном UPDATE'
+        )
+
+    def handle(self, *args, batch_size, **kwargs):
+        started = time.monotonic()
+        events = load_events()
+        recipe_ids, scores = compute_scores(*events)
+        reset = store_scores(recipe_ids, scores, batch_size)
+        # Сортировка по оценкам видна в кешированных ответах
+        bump_recipes_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Событий {len(events[0])}, оценено рецептов {len(recipe_ids)}, '
+            f'обнулено {reset} за {time.monotonic() - started:.1f} с.'
+        ))
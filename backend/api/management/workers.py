@@ -0,0 +1,12 @@
+import django
+from django.conf import settings
+
+
+def init_worker(media_root):
+    """Настройка процесса пула команды: Django и MEDIA_ROOT родителя.
+
+    Модуль не импортирует моделей: дочерний процесс загружает его
+    до django.setup().
+    """
+    django.setup()
+    settings.MEDIA_ROOT = media_root
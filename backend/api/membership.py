@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Exists, OuterRef
+
+from .models import Favorite, ShoppingCart, Subscription
+
+
+# Множество id, хранимое для пользователя: модель связи и её поле
+KINDS = {
+    Favorite: ('favorites', 'recipe_id'),
+    ShoppingCart: ('shopping_cart', 'recipe_id'),
+    Subscription: ('subscriptions', 'author_id'),
+}
+
+
+def membership_cache():
+    return caches[settings.MEMBERSHIP_CACHE]
+
+
+def cache_key(model, user_id):
+    return f'membership:{KINDS[model][0]}:{user_id}'
+
+
+def invalidate_membership(model, user_id):
+    membership_cache().delete(cache_key(model, user_id))
+
+
+def member_ids(model, user):
+    # Множество кешируется надолго, поэтому читается с основной БД:
+    # отстающая реплика закешировала бы его без свежих изменений.
+    # Без order_by() Meta.ordering подписок соединила бы api_user
+    # ради сортировки, ненужной множеству
+    return (model.objects.using(DEFAULT_DB_ALIAS).filter(user=user)
+            .order_by().values_list(KINDS[model][1], flat=True))
+
+
+def member_exists(model, user):
+    """Условие «объект входит в множество пользователя» подзапросом."""
+    return Exists(model.objects.filter(
+        user=user, **{KINDS[model][1]: OuterRef('pk')}))
+
+
+class Membership:
+    """Избранное, корзина и подписки пользователя как множества id.
+
+    Каждое множество читается из кеша (или из БД при промахе) не больше
+    одного раза за запрос.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._sets = {}
+
+    def get(self, model):
+        if model not in self._sets:
+            self._sets[model] = self._load(model)
+        return self._sets[model]
+
+    def _load(self, model):
+        if not self.user.is_authenticated:
+            return set()
+        key = cache_key(model, self.user.pk)
+        cache = membership_cache()
+        ids = cache.get(key)
+        if ids is None:
+            ids = set(member_ids(model, self.user))
+            cache.set(key, ids, settings.MEMBERSHIP_CACHE_TIMEOUT)
+        return ids
+
+    async def aload(self, *models):
+        """Заранее читает множества для асинхронных вьюх.
+
+        Промахи кеша догружаются из БД асинхронным ORM.
+        """
+        models = [model for model in models if model not in self._sets]
+        if not self.user.is_authenticated:
+            self._sets.update((model, set()) for model in models)
+            return
+        cache = membership_cache()
+        keys = {cache_key(model, self.user.pk): model for model in models}
+        cached = await cache.aget_many(keys)
+        for key, model in keys.items():
+            ids = cached.get(key)
+            if ids is None:
+                ids = {pk async for pk in member_ids(model, self.user)}
+                await cache.aset(key, ids, settings.MEMBERSHIP_CACHE_TIMEOUT)
+            self._sets[model] = ids
+
+    def update(self, model, pk, present):
+        """Отражает изменение в рамках текущего запроса.
+
+        Кеш сбрасывается сигналами после фиксации транзакции.
+        """
+        ids = self.get(model)
+        if present:
+            ids.add(pk)
+        else:
+            ids.discard(pk)
+
+    @property
+    def favorites(self):
+        return self.get(Favorite)
+
+    @property
+    def shopping_cart(self):
+        return self.get(ShoppingCart)
+
+    @property
+    def subscriptions(self):
+        return self.get(Subscription)
+
+
+def get_membership(request):
+    membership = getattr(request, '_membership', None)
+    if membership is None or membership.user != request.user:
+        membership = request._membership = Membership(request.user)
+    return membership
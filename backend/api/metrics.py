@@ -0,0 +1,275 @@
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.decorators import sync_and_async_middleware
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = tuple(1 << power for power in range(8, 24, 2))
+# Гистограммы по маршрутам: имя -> (описание, границы корзин)
+HISTOGRAMS = {
+    'http_request_duration_seconds': (
+        'Время обработки запроса', DURATION_BUCKETS),
+    'http_request_db_queries': (
+        'SQL-запросов за запрос', QUERY_BUCKETS),
+    'http_request_db_duration_seconds': (
+        'Время SQL-запросов за запрос', DURATION_BUCKETS),
+    'http_request_serialize_duration_seconds': (
+        'Время сериализаторов за запрос', DURATION_BUCKETS),
+    'http_response_size_bytes': (
+        'Размер ответа', SIZE_BUCKETS),
+}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Замеры текущего запроса; None вне запроса
+current_stats = ContextVar('current_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db', 'serialize', 'depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.depth = 0
+
+
+def record_query(execute, sql, params, many, context):
+    """Обёртка выполнения SQL; ставится на каждое соединение."""
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    """Время сериализации попадает в замеры запроса.
+
+    Считается только внешний to_representation: вложенные сериализаторы
+    уже входят в него.
+    """
+
+    def to_representation(self, instance):
+        stats = current_stats.get()
+        if stats is None or stats.depth:
+            return super().to_representation(instance)
+        started = time.perf_counter()
+        stats.depth += 1
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.depth -= 1
+            stats.serialize += time.perf_counter() - started
+
+
+def escape(value):
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+class Metrics:
+    """Счётчики и гистограммы по маршрутам в памяти процесса.
+
+    Запись замера — несколько сложений под блокировкой. Раз в
+    METRICS_FLUSH_SECONDS процесс кладёт накопленное в общий кеш,
+    а /metrics складывает снимки всех процессов.
+    """
+
+    PROCESSES_KEY = 'metrics:processes'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._id = uuid.uuid4().hex
+        self._flushed = time.monotonic()
+        # (маршрут, метод, статус) -> запросов
+        self._requests = Counter()
+        # (гистограмма, маршрут) -> число попаданий в корзины и сумма
+        self._histograms = {}
+
+    def _snapshot_key(self, process_id):
+        return f'metrics:process:{process_id}'
+
+    def observe(self, route, method, status, values):
+        """Учитывает запрос; True, если пора опубликовать снимок."""
+        with self._lock:
+            self._requests[(route, method, status)] += 1
+            for name, value in values.items():
+                buckets = HISTOGRAMS[name][1]
+                data = self._histograms.get((name, route))
+                if data is None:
+                    data = self._histograms[(name, route)] = (
+                        [0] * (len(buckets) + 2))
+                data[bisect_left(buckets, value)] += 1
+                data[-1] += value
+            return (time.monotonic() - self._flushed
+                    >= settings.METRICS_FLUSH_SECONDS)
+
+    def flush(self):
+        with self._lock:
+            self._flushed = time.monotonic()
+            snapshot = (Counter(self._requests), {
+                key: list(data) for key, data in self._histograms.items()})
+        cache.set(self._snapshot_key(self._id), snapshot,
+                  settings.METRICS_SNAPSHOT_TIMEOUT)
+        processes = cache.get(self.PROCESSES_KEY, set())
+        if self._id not in processes:
+            cache.set(self.PROCESSES_KEY, processes | {self._id}, None)
+
+    def collect(self):
+        """Сумма снимков всех процессов, текущий — самый свежий."""
+        self.flush()
+        processes = cache.get(self.PROCESSES_KEY, set())
+        snapshots = cache.get_many(
+            [self._snapshot_key(process_id) for process_id in processes])
+        if len(snapshots) < len(processes):
+            # Снимки завершившихся процессов истекли
+            cache.set(self.PROCESSES_KEY, {
+                key.rsplit(':', 1)[1] for key in snapshots}, None)
+        requests, histograms = Counter(), {}
+        for process_requests, process_histograms in snapshots.values():
+            requests.update(process_requests)
+            for key, data in process_histograms.items():
+                total = histograms.setdefault(key, [0] * len(data))
+                for position, value in enumerate(data):
+                    total[position] += value
+        return requests, histograms
+
+    def export(self):
+        """Метрики в текстовом формате Prometheus."""
+        requests, histograms = self.collect()
+        lines = [
+            '# HELP http_requests_total Запросов по маршрутам',
+            '# TYPE http_requests_total counter',
+        ]
+        for (route, method, status), count in sorted(requests.items()):
+            lines.append(
+                f'http_requests_total{{route="{escape(route)}",'
+                f'method="{escape(method)}",status="{status}"}} {count}')
+        for name, (description, buckets) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {description}',
+                      f'# TYPE {name} histogram']
+            for (histogram, route), data in sorted(histograms.items()):
+                if histogram != name:
+                    continue
+                label = f'route="{escape(route)}"'
+                cumulative = 0
+                for bound, count in zip((*buckets, '+Inf'), data):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines += [f'{name}_sum{{{label}}} {float(data[-1])!r}',
+                          f'{name}_count{{{label}}} {cumulative}']
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def route_of(request):
+    match = request.resolver_match
+    return match.view_name if match else 'unmatched'
+
+
+def server_timing(stats, total):
+    return (f'db;dur={stats.db * 1000:.1f};desc="{stats.queries} SQL", '
+            f'serialize;dur={stats.serialize * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}')
+
+
+def finish(request, response, stats, started, size):
+    """Учитывает запрос; True, если пора опубликовать снимок."""
+    return metrics.observe(
+        route_of(request), request.method, response.status_code, {
+            'http_request_duration_seconds': time.perf_counter() - started,
+            'http_request_db_queries': stats.queries,
+            'http_request_db_duration_seconds': stats.db,
+            'http_request_serialize_duration_seconds': stats.serialize,
+            'http_response_size_bytes': size,
+        })
+
+
+def measured_stream(chunks, request, response, stats, started):
+    """Потоковый ответ учитывается, когда отдан целиком: SQL и размер."""
+    size = 0
+    token = current_stats.set(stats)
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        current_stats.reset(token)
+        if finish(request, response, stats, started, size):
+            metrics.flush()
+
+
+async def ameasured_stream(chunks, request, response, stats, started):
+    """То же для асинхронного потокового ответа."""
+    size = 0
+    token = current_stats.set(stats)
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        current_stats.reset(token)
+        if finish(request, response, stats, started, size):
+            await sync_to_async(metrics.flush)()
+
+
+def complete(request, response, stats, started):
+    """Заголовок Server-Timing; для обычного ответа — и учёт в метриках.
+
+    Возвращает True, если пора опубликовать снимок.
+    """
+    response['Server-Timing'] = server_timing(
+        stats, time.perf_counter() - started)
+    if route_of(request) == 'metrics':
+        return False
+    if response.streaming:
+        measure = ameasured_stream if response.is_async else measured_stream
+        response.streaming_content = measure(
+            response.streaming_content, request, response, stats, started)
+        return False
+    return finish(request, response, stats, started, len(response.content))
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Замеры запроса: SQL, сериализаторы, общее время, размер ответа."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started, stats = time.perf_counter(), RequestStats()
+            token = current_stats.set(stats)
+            try:
+                response = await get_response(request)
+            finally:
+                current_stats.reset(token)
+            if complete(request, response, stats, started):
+                await sync_to_async(metrics.flush)()
+            return response
+    else:
+        def middleware(request):
+            started, stats = time.perf_counter(), RequestStats()
+            token = current_stats.set(stats)
+            try:
+                response = get_response(request)
+            finally:
+                current_stats.reset(token)
+            if complete(request, response, stats, started):
+                metrics.flush()
+            return response
+    return middleware
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.21 on 2026-10-17 05:55
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_url_hash(apps, schema_editor):
+    ShortLink = apps.get_model('api', 'ShortLink')
+    seen = set()
+    links = ShortLink.objects.order_by('created', 'id')
+    for link in links.iterator():
+        url_hash = hashlib.sha256(link.original_url.encode()).hexdigest()
+        # Хеш получает самая старая ссылка, дубли продолжают работать по slug
+        if url_hash in seen:
+            continue
+        seen.add(url_hash)
+        link.url_hash = url_hash
+        link.save(update_fields=('url_hash',))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_recipe_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shortlink',
+            name='url_hash',
+            field=models.CharField(editable=False, max_length=64, null=True, unique=True, verbose_name='Хеш ссылки'),
+        ),
+        migrations.RunPython(fill_url_hash, migrations.RunPython.noop),
+    ]
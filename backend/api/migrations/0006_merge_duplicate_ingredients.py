@@ -0,0 +1,47 @@
+# Generated by Django 4.2.21 on 2026-10-17 06:05
+
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+
+
+# Предел SmallIntegerField для RecipeIngredient.amount
+MAX_AMOUNT = 32767
+
+
+def merge_duplicates(apps, schema_editor):
+    """Повторы, созданные прежними запусками load_ingredients,
+    сливаются в запись с наименьшим id."""
+    Ingredient = apps.get_model('api', 'Ingredient')
+    RecipeIngredient = apps.get_model('api', 'RecipeIngredient')
+    groups = (Ingredient.objects.values('name', 'measurement_unit')
+              .annotate(keep=Min('pk'), total=Count('pk'))
+              .filter(total__gt=1).order_by())
+    for group in groups:
+        duplicates = Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(pk=group['keep'])
+        RecipeIngredient.objects.filter(ingredient__in=duplicates).update(
+            ingredient_id=group['keep'])
+        # Рецепт мог ссылаться на несколько повторов: количества
+        # складываются в одну строку, остальные удаляются
+        rows = RecipeIngredient.objects.filter(ingredient_id=group['keep'])
+        for merged in (rows.values('recipe_id')
+                       .annotate(row=Min('pk'), amount=Sum('amount'),
+                                 total=Count('pk'))
+                       .filter(total__gt=1).order_by()):
+            RecipeIngredient.objects.filter(pk=merged['row']).update(
+                amount=min(merged['amount'], MAX_AMOUNT))
+            rows.filter(recipe_id=merged['recipe_id']).exclude(
+                pk=merged['row']).delete()
+        duplicates.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
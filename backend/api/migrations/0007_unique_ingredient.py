@@ -0,0 +1,19 @@
+# Generated by Django 4.2.21 on 2026-10-17 06:05
+
+from django.db import migrations, models
+
+
+# Отдельная миграция: в PostgreSQL таблицу нельзя менять в той же
+# транзакции, где остались отложенные проверки внешних ключей
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_merge_duplicate_ingredients'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
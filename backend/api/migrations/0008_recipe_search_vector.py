@@ -0,0 +1,59 @@
+# Generated by Django 4.2.21 on 2026-10-17 06:07
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Название весит больше описания; конфигурация совпадает с
+# api.search.RECIPE_SEARCH_CONFIG
+CREATE_TRIGGER = '''
+CREATE FUNCTION api_recipe_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(NEW.text, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER api_recipe_search_vector
+    BEFORE INSERT OR UPDATE OF name, text ON api_recipe
+    FOR EACH ROW EXECUTE FUNCTION api_recipe_search_vector();
+
+UPDATE api_recipe SET name = name;
+
+CREATE INDEX recipe_search_vector_idx ON api_recipe USING gin (search_vector);
+'''
+
+DROP_TRIGGER = '''
+DROP INDEX IF EXISTS recipe_search_vector_idx;
+DROP TRIGGER IF EXISTS api_recipe_search_vector ON api_recipe;
+DROP FUNCTION IF EXISTS api_recipe_search_vector();
+'''
+
+
+def run_on_postgresql(sql):
+    # На SQLite (тесты) поиск работает через LIKE, вектор не нужен
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(
+            run_on_postgresql(CREATE_TRIGGER),
+            run_on_postgresql(DROP_TRIGGER)
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.21 on 2026-10-17 06:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSimilarityBuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_favorite_id', models.BigIntegerField(default=0)),
+                ('last_shopping_cart_id', models.BigIntegerField(default=0)),
+                ('full', models.BooleanField(verbose_name='Полный пересчёт')),
+                ('recipes', models.PositiveIntegerField(verbose_name='Пересчитано рецептов')),
+                ('finished_at', models.DateTimeField(auto_now_add=True, verbose_name='Завершён')),
+            ],
+            options={
+                'verbose_name': 'Расчёт похожих рецептов',
+                'verbose_name_plural': 'Расчёты похожих рецептов',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipeSimilarity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Сходство')),
+                ('recipe', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='similarities', to='api.recipe', verbose_name='Рецепт')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.recipe', verbose_name='Похожий рецепт')),
+            ],
+            options={
+                'verbose_name': 'Похожий рецепт',
+                'verbose_name_plural': 'Похожие рецепты',
+                'indexes': [models.Index(fields=['recipe', '-score'], name='similarity_recipe_score_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.21 on 2026-10-17 06:18
+
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+# Время добавления прежних записей неизвестно, а дата публикации рецепта
+# его не заменяет: 0011_feed проставила старым рецептам время выкладки.
+# Записи получают заведомо давнюю дату и в оценки с затуханием почти
+# не входят, иначе на несколько дней заняли бы выдачу ?ordering=trending
+LEGACY_CREATED = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def backfill_created(apps, schema_editor):
+    for name in ('Favorite', 'ShoppingCart'):
+        apps.get_model('api', name).objects.update(created=LEGACY_CREATED)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_recipe_similarity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Добавлено'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='popularity_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Популярность'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Популярность за последние дни'),
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Добавлено'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_created, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-popularity_score', 'id'], name='recipe_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-trending_score', 'id'], name='recipe_trending_idx'),
+        ),
+    ]
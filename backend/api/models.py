@@ -1,6 +1,8 @@
+import hashlib
 import uuid
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.core.validators import MinValueValidator
 
@@ -14,6 +16,12 @@ class Ingredient(models.Model):
 
     class Meta:
         ordering = ('name',)
+        constraints = (
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient'
+            ),
+        )
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
 
@@ -47,6 +55,29 @@ class User(AbstractUser):
         blank=True,
         verbose_name='Аватар'
     )
+    # Уменьшенные копии аватара, их строит api.images
+    avatar_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Варианты аватара'
+    )
+    # Счётчики ведутся сигналами, пересчёт — команда reconcile_counters
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов'
+    )
+    subscriptions_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписок'
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков'
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')
@@ -65,7 +96,9 @@ class Recipe(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='recipes',
-        verbose_name='Автор'
+        verbose_name='Автор',
+        # Его заменяет индекс recipe_author_name_idx
+        db_index=False
     )
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -81,15 +114,62 @@ class Recipe(models.Model):
         blank=False,
         verbose_name='Изображение'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Варианты изображения'
+    )
     cooking_time = models.IntegerField(
         verbose_name='Время приготовления',
         validators=(MinValueValidator(1),)
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    pub_date = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата публикации'
+    )
+    # Вычисляются командой update_recipe_scores
+    popularity_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Популярность'
+    )
+    trending_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Популярность за последние дни'
+    )
+    # Заполняется триггером PostgreSQL из названия и описания
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор'
+    )
 
     class Meta:
         ordering = ('name',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(fields=('name', 'id'), name='recipe_name_id_idx'),
+            # Рецепты автора (?author=, превью в подписках) уже в порядке
+            # выдачи, без сортировки
+            models.Index(fields=('author', 'name', 'id'),
+                         name='recipe_author_name_idx'),
+            # Новые рецепты популярных авторов для ленты подписок
+            models.Index(fields=('author', '-pub_date', '-id'),
+                         name='recipe_author_pub_date_idx'),
+            # Ключи курсора для ?ordering=popular и ?ordering=trending
+            models.Index(fields=('-popularity_score', 'id'),
+                         name='recipe_popular_idx'),
+            models.Index(fields=('-trending_score', 'id'),
+                         name='recipe_trending_idx'),
+        )
 
     def __str__(self):
         return self.name
@@ -104,6 +184,15 @@ class ShortLink(models.Model):
     original_url = models.URLField(
         verbose_name='Оригинальная ссылка'
     )
+    # Уникальный хеш адреса: поиск по индексу и защита от дублей.
+    # У дублей, созданных до его появления, остаётся NULL
+    url_hash = models.CharField(
+        unique=True,
+        null=True,
+        max_length=64,
+        editable=False,
+        verbose_name='Хеш ссылки'
+    )
     created = models.DateTimeField(
         auto_now_add=True,
         verbose_name='Дата создания'
@@ -113,9 +202,15 @@ class ShortLink(models.Model):
         verbose_name = 'Короткая ссылка'
         verbose_name_plural = 'Короткие ссылки'
 
+    @staticmethod
+    def hash_url(url):
+        return hashlib.sha256(url.encode()).hexdigest()
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = uuid.uuid4().hex[:7]
+        if not self.url_hash:
+            self.url_hash = self.hash_url(self.original_url)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -133,7 +228,9 @@ class RecipeIngredient(models.Model):
         Ingredient,
         on_delete=models.CASCADE,
         related_name='recipe_ingredients',
-        verbose_name='Ингредиент'
+        verbose_name='Ингредиент',
+        # Его заменяет индекс ingredient_recipe_idx
+        db_index=False
     )
     amount = models.SmallIntegerField(
         verbose_name='Количество',
@@ -141,6 +238,13 @@ class RecipeIngredient(models.Model):
     )
 
     class Meta:
+        # Обратный индекс «ингредиент -> рецепты» для фильтров
+        # ?ingredients= и ?exclude_ingredients=: читается без обращения
+        # к таблице
+        indexes = (
+            models.Index(fields=('ingredient', 'recipe'),
+                         name='ingredient_recipe_idx'),
+        )
         verbose_name = 'Ингредиент рецепта'
         verbose_name_plural = 'Ингредиенты рецепта'
 
@@ -150,17 +254,21 @@ class RecipeIngredient(models.Model):
 
 
 class Subscription(models.Model):
+    # Индексы внешних ключей заменены составными: unique_subscription
+    # (user, author) и subscription_author_user_idx (author, user)
     user = models.ForeignKey(
         User,
         related_name='followers',
         on_delete=models.CASCADE,
-        verbose_name='Подписчик'
+        verbose_name='Подписчик',
+        db_index=False
     )
     author = models.ForeignKey(
         User,
         related_name='authors',
         on_delete=models.CASCADE,
-        verbose_name='Автор'
+        verbose_name='Автор',
+        db_index=False
     )
 
     class Meta:
@@ -173,22 +281,31 @@ class Subscription(models.Model):
                 name='unique_subscription'
             ),
         )
+        indexes = (
+            models.Index(fields=('author', 'user'),
+                         name='subscription_author_user_idx'),
+        )
 
 
 class Favorite(models.Model):
+    # Поиск по пользователю идёт по индексу unique_favorite (user, recipe)
     user = models.ForeignKey(
         User, on_delete=models.CASCADE,
         related_name='favorites',
-        verbose_name='Пользователь'
+        verbose_name='Пользователь',
+        db_index=False
     )
     recipe = models.ForeignKey(
         Recipe, on_delete=models.CASCADE,
         related_name='favorites',
         verbose_name='Рецепт'
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Добавлено'
+    )
 
     class Meta:
-        unique_together = ('user', 'recipe')
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
         constraints = (
@@ -203,14 +320,20 @@ class Favorite(models.Model):
 
 
 class ShoppingCart(models.Model):
+    # Поиск по пользователю идёт по индексу unique_shopping_cart
     user = models.ForeignKey(
         User, on_delete=models.CASCADE,
-        related_name='shopping_carts'
+        related_name='shopping_carts',
+        db_index=False
     )
     recipe = models.ForeignKey(
         Recipe, on_delete=models.CASCADE,
         related_name='in_carts'
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Добавлено'
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -224,3 +347,116 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user} - {self.recipe}'
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика, записанный при публикации."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Подписчик',
+        # Его заменяет индекс feed_user_pub_date_idx
+        db_index=False
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    # Копия Recipe.pub_date: лента читается по индексу без соединения
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_entry'
+            ),
+        )
+        indexes = (
+            models.Index(fields=('user', '-pub_date', '-recipe'),
+                         name='feed_user_pub_date_idx'),
+        )
+
+    def __str__(self):
+        return f'{self.user} - {self.recipe}'
+
+
+class RecipeSimilarity(models.Model):
+    """Сосед рецепта по совместному добавлению в избранное и корзину.
+
+    Таблицу заполняет команда build_similar_recipes.
+    """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similarities',
+        verbose_name='Рецепт',
+        # Его заменяет индекс similarity_recipe_score_idx
+        db_index=False
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        indexes = (
+            models.Index(fields=('recipe', '-score'),
+                         name='similarity_recipe_score_idx'),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} - {self.similar}: {self.score:.3f}'
+
+
+class RecipeSimilarityBuild(models.Model):
+    """Запуск build_similar_recipes: до каких id учтены связи."""
+
+    last_favorite_id = models.BigIntegerField(default=0)
+    last_shopping_cart_id = models.BigIntegerField(default=0)
+    full = models.BooleanField(verbose_name='Полный пересчёт')
+    recipes = models.PositiveIntegerField(
+        verbose_name='Пересчитано рецептов')
+    finished_at = models.DateTimeField(
+        auto_now_add=True, verbose_name='Завершён')
+
+    class Meta:
+        verbose_name = 'Расчёт похожих рецептов'
+        verbose_name_plural = 'Расчёты похожих рецептов'
+
+    def __str__(self):
+        return f'{self.finished_at:%Y-%m-%d %H:%M}: {self.recipes}'
+
+
+class RecipeImport(models.Model):
+    """Позиция load_recipes в файле: строки до неё уже загружены.
+
+    Обновляется в одной транзакции с рецептами порции, поэтому после
+    сбоя загрузка продолжается без повторов.
+    """
+
+    source = models.CharField(
+        max_length=255, unique=True, verbose_name='Источник')
+    last_line = models.PositiveIntegerField(
+        default=0, verbose_name='Последняя загруженная строка')
+    updated_at = models.DateTimeField(
+        auto_now=True, verbose_name='Обновлена')
+
+    class Meta:
+        verbose_name = 'Загрузка рецептов'
+        verbose_name_plural = 'Загрузки рецептов'
+
+    def __str__(self):
+        return f'{self.source}: {self.last_line}'
@@ -0,0 +1,167 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .feed import parse_position
+
+
+class LimitOffsetOrCursorPagination(LimitOffsetPagination):
+    """limit/offset по умолчанию, keyset-пагинация при наличии ?cursor=.
+
+    В режиме курсора страница выбирается условием по составному ключу
+    сортировки (view.cursor_ordering, поля с «-» — по убыванию) без
+    OFFSET и без COUNT(*). Последнее поле ключа должно быть уникальным.
+    """
+
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+    default_cursor_ordering = ('id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.cursor_query_param in request.query_params
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
+        return self.cut_page(list(
+            self.cursor_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """То же для асинхронных вьюх: выборка через асинхронный ORM."""
+        self.use_cursor = self.cursor_query_param in request.query_params
+        if self.use_cursor:
+            return self.cut_page([
+                obj async for obj in
+                self.cursor_queryset(queryset, request, view)])
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.count = await queryset.acount()
+        self.offset = self.get_offset(request)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return [obj async for obj in
+                queryset[self.offset:self.offset + self.limit]]
+
+    def cursor_queryset(self, queryset, request, view):
+        """Страница после курсора и ещё одна запись — признак продолжения."""
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.ordering = getattr(
+            view, 'cursor_ordering', self.default_cursor_ordering)
+        position = self.clean_position(queryset.model, self.decode_cursor(
+            request.query_params[self.cursor_query_param]))
+
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        return queryset[:self.limit + 1]
+
+    def cut_page(self, page):
+        self.next_position = None
+        if len(page) > self.limit:
+            page = page[:self.limit]
+            self.next_position = [
+                getattr(page[-1], field.lstrip('-'))
+                for field in self.ordering]
+        return page
+
+    @staticmethod
+    def compare(field, strict=True):
+        """Лукап «дальше по порядку» для поля ключа."""
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        return f'{field.lstrip("-")}__{lookup}{"" if strict else "e"}'
+
+    def after(self, position):
+        """(f1, f2, ...) > (v1, v2, ...) в виде, понятном индексу."""
+        condition = Q()
+        for index in reversed(range(len(self.ordering))):
+            equal = {field.lstrip('-'): value for field, value in zip(
+                self.ordering[:index], position[:index])}
+            condition |= Q(**equal, **{
+                self.compare(self.ordering[index]): position[index]})
+        # Граница по первому полю позволяет начать скан по индексу
+        return Q(**{
+            self.compare(self.ordering[0], strict=False): position[0]
+        }) & condition
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(cursor.encode()))
+        except (Base64Error, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list)
+                or len(position) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def clean_position(self, model, position):
+        """Значения курсора, приведённые к типам полей ключа.
+
+        Поля ключа не допускают NULL, так что None в курсоре — ошибка.
+        """
+        if position is None:
+            return None
+        cleaned = []
+        for field, value in zip(self.ordering, position):
+            try:
+                if value is None:
+                    raise ValidationError(value)
+                cleaned.append(model._meta.get_field(
+                    field.lstrip('-')).clean(value, None))
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+        return cleaned
+
+    def encode_cursor(self, position):
+        return urlsafe_b64encode(
+            json.dumps(position, ensure_ascii=False).encode()).decode()
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.offset_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param,
+            self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+class FeedPagination(LimitOffsetOrCursorPagination):
+    """Лента подписок: только курсор по (pub_date, id) по убыванию.
+
+    Страницу собирает api.feed.feed_page из нескольких источников,
+    поэтому вместо QuerySet пагинатор получает функцию выборки.
+    """
+
+    ordering = ('pub_date', 'id')
+
+    def paginate_feed(self, fetch, request):
+        self.use_cursor = True
+        self.request = request
+        self.limit = self.get_limit(request)
+        try:
+            position = parse_position(self.decode_cursor(
+                request.query_params.get(self.cursor_query_param)))
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        ids, self.next_position = fetch(position, self.limit)
+        return ids
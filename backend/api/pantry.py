@@ -0,0 +1,180 @@
+import threading
+import uuid
+
+import numpy as np
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from scipy import sparse
+
+from .models import RecipeIngredient
+
+
+class PantryIndex:
+    """Матрица «рецепт × ингредиент» в памяти процесса.
+
+    Изменённые рецепты записываются в журнал в общем кеше под
+    возрастающими номерами. Отставший процесс дочитывает журнал
+    и перезагружает из БД только эти рецепты: их старые строки
+    выключаются, новые дописываются в конец матрицы. Если сменилась
+    эпоха (invalidate() или очистка кеша), журнал потерян или
+    выключенных строк слишком много, матрица строится заново.
+    """
+
+    EPOCH_KEY = 'recipes:pantry:epoch'
+    NUMBER_KEY = 'recipes:pantry:number'
+    CHANGES_TIMEOUT = 60 * 60
+    MAX_CHANGES = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._epoch = None
+        self._number = None
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.int32)
+        self._recipe_ids = np.empty(0, dtype=np.int64)
+        self._sizes = np.empty(0, dtype=np.int32)
+        self._active = np.empty(0, dtype=bool)
+        self._rows = {}
+        self._columns = {}
+
+    def _changes_key(self, epoch, number):
+        return f'recipes:pantry:changes:{epoch}:{number}'
+
+    def _current_version(self):
+        epoch = cache.get_or_set(self.EPOCH_KEY, uuid.uuid4().hex, None)
+        cache.add(self.NUMBER_KEY, 0, None)
+        return epoch, cache.get(self.NUMBER_KEY, 0)
+
+    def changed(self, recipe_ids):
+        epoch, _ = self._current_version()
+        number = cache.incr(self.NUMBER_KEY)
+        cache.set(self._changes_key(epoch, number), set(recipe_ids),
+                  self.CHANGES_TIMEOUT)
+
+    def invalidate(self):
+        cache.set(self.EPOCH_KEY, uuid.uuid4().hex, None)
+
+    def _load(self, recipe_ids=None):
+        """Строки матрицы для рецептов (по умолчанию для всех).
+
+        Читаются с основной БД: реплика может ещё не видеть изменений
+        из журнала.
+        """
+        rows = RecipeIngredient.objects.using(
+            DEFAULT_DB_ALIAS).order_by().distinct()
+        if recipe_ids is not None:
+            rows = rows.filter(recipe_id__in=recipe_ids)
+        pairs = np.array(
+            list(rows.values_list('recipe_id', 'ingredient_id')),
+            dtype=np.int64
+        ).reshape(-1, 2)
+        recipe_ids, row_numbers = np.unique(pairs[:, 0], return_inverse=True)
+        columns = np.fromiter(
+            (self._columns.setdefault(pk, len(self._columns))
+             for pk in pairs[:, 1].tolist()),
+            dtype=np.int64, count=len(pairs)
+        )
+        matrix = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.int32), (row_numbers, columns)),
+            shape=(len(recipe_ids), len(self._columns))
+        )
+        return matrix, recipe_ids
+
+    def _append(self, matrix, recipe_ids):
+        width = len(self._columns)
+        self._matrix.resize((self._matrix.shape[0], width))
+        matrix.resize((matrix.shape[0], width))
+        start = len(self._recipe_ids)
+        self._matrix = sparse.vstack((self._matrix, matrix), format='csr')
+        self._recipe_ids = np.concatenate((self._recipe_ids, recipe_ids))
+        self._sizes = np.concatenate((
+            self._sizes, np.diff(matrix.indptr).astype(np.int32)))
+        self._active = np.concatenate(
+            (self._active, np.ones(len(recipe_ids), dtype=bool)))
+        for offset, pk in enumerate(recipe_ids.tolist()):
+            self._rows[pk] = start + offset
+
+    def _rebuild(self, epoch, number):
+        self._reset()
+        self._append(*self._load())
+        self._epoch, self._number = epoch, number
+
+    def _apply(self, recipe_ids, number):
+        for pk in recipe_ids:
+            row = self._rows.pop(pk, None)
+            if row is not None:
+                self._active[row] = False
+        self._append(*self._load(recipe_ids))
+        self._number = number
+        if (~self._active).sum() > len(self._active) // 2:
+            self._rebuild(self._epoch, number)
+
+    def ensure_fresh(self):
+        epoch, number = self._current_version()
+        if (epoch, number) == (self._epoch, self._number):
+            return
+        with self._lock:
+            if (epoch, number) == (self._epoch, self._number):
+                return
+            behind = number - (self._number or 0)
+            if epoch != self._epoch or not 0 < behind <= self.MAX_CHANGES:
+                return self._rebuild(epoch, number)
+            changes = cache.get_many([
+                self._changes_key(epoch, known)
+                for known in range(self._number + 1, number + 1)
+            ])
+            if len(changes) < behind:
+                return self._rebuild(epoch, number)
+            self._apply(set().union(*changes.values()), number)
+
+    def match(self, ingredient_ids):
+        """Рецепты, где есть хотя бы один ингредиент из наличия.
+
+        Один проход умножения матрицы на вектор наличия; сначала рецепты
+        с наибольшей долей ингредиентов в наличии, при равенстве —
+        с меньшим числом недостающих.
+        """
+        self.ensure_fresh()
+        with self._lock:
+            columns = [self._columns[pk] for pk in set(ingredient_ids)
+                       if pk in self._columns]
+            pantry = np.zeros(len(self._columns), dtype=np.int32)
+            pantry[columns] = 1
+            found = self._matrix @ pantry
+            found[~self._active] = 0
+            rows = np.flatnonzero(found)
+            recipe_ids = self._recipe_ids[rows]
+            sizes = self._sizes[rows]
+        coverage = found[rows] / sizes
+        missing = sizes - found[rows]
+        order = np.lexsort((recipe_ids, missing, -coverage))
+        return Matches(recipe_ids[order], coverage[order], missing[order])
+
+
+class Matches:
+    """Результат подбора; срез даёт (id рецепта, доля, недостаёт).
+
+    Пагинатор берёт len() и срез страницы, так что в объекты Python
+    превращается только она.
+    """
+
+    def __init__(self, recipe_ids, coverage, missing):
+        self.recipe_ids = recipe_ids
+        self.coverage = coverage
+        self.missing = missing
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def __getitem__(self, index):
+        return [
+            (int(pk), round(float(share), 4), int(lack))
+            for pk, share, lack in zip(
+                self.recipe_ids[index], self.coverage[index],
+                self.missing[index])
+        ]
+
+
+pantry_index = PantryIndex()
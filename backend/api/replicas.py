@@ -0,0 +1,104 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import SAFE_METHODS
+
+
+# Реплика, с которой читает текущий запрос; None — основная БД
+current_replica = ContextVar('current_replica', default=None)
+
+
+class ReplicaRouter:
+    """Чтение — с реплики, которую выбрала replica_middleware.
+
+    Токены читаются с основной БД: только что выданный токен может
+    ещё не дойти до реплики. Записи и миграции — только в основную БД.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model is Token:
+            return DEFAULT_DB_ALIAS
+        return current_replica.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На репликах те же данные, что в основной БД
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def primary():
+    """Читать с основной БД внутри блока."""
+    token = current_replica.set(None)
+    try:
+        yield
+    finally:
+        current_replica.reset(token)
+
+
+def pin_key(request):
+    """Ключ закрепления клиента: по токену или сессии; у анонима нет."""
+    identity = (request.headers.get('Authorization')
+                or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if identity:
+        digest = hashlib.md5(identity.encode()).hexdigest()
+        return f'replicas:pinned:{digest}'
+
+
+def choose_replica(request, pinned):
+    if (request.method not in SAFE_METHODS or pinned
+            or not settings.DATABASE_REPLICAS):
+        return None
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+def wrote(request, response):
+    return (request.method not in SAFE_METHODS
+            and response.status_code < 400)
+
+
+@sync_and_async_middleware
+def replica_middleware(get_response):
+    """Безопасные запросы читают с одной из реплик.
+
+    После успешной записи клиент REPLICA_PIN_SECONDS читает с основной
+    БД, чтобы сразу видеть свои изменения (например, is_favorited).
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            key = pin_key(request) if settings.DATABASE_REPLICAS else None
+            pinned = key is not None and await cache.aget(key, False)
+            token = current_replica.set(choose_replica(request, pinned))
+            try:
+                response = await get_response(request)
+            finally:
+                current_replica.reset(token)
+            if key is not None and wrote(request, response):
+                await cache.aset(key, True, settings.REPLICA_PIN_SECONDS)
+            return response
+    else:
+        def middleware(request):
+            key = pin_key(request) if settings.DATABASE_REPLICAS else None
+            pinned = key is not None and cache.get(key, False)
+            token = current_replica.set(choose_replica(request, pinned))
+            try:
+                response = get_response(request)
+            finally:
+                current_replica.reset(token)
+            if key is not None and wrote(request, response):
+                cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+            return response
+    return middleware
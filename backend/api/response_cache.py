@@ -0,0 +1,138 @@
+import hashlib
+import time
+from contextlib import nullcontext
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .replicas import primary
+
+
+VERSION_KEY = 'recipes:version'
+
+
+def recipes_version():
+    """Время последнего изменения данных, видимых в рецептах."""
+    return cache.get_or_set(VERSION_KEY, time.time, None)
+
+
+async def arecipes_version():
+    return await cache.aget_or_set(VERSION_KEY, time.time, None)
+
+
+def bump_recipes_version():
+    # Старые ответы не удаляем: они недостижимы и истекут сами
+    cache.set(VERSION_KEY, time.time(), None)
+
+
+def request_digest(request):
+    """Хеш адреса и отсортированных параметров запроса.
+
+    Схема и хост входят в ключ: в ответах есть абсолютные ссылки.
+    """
+    query = urlencode(sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        for value in values
+    ))
+    return hashlib.md5(
+        f'{request.scheme}://{request.get_host()}{request.path}?{query}'
+        .encode()).hexdigest()
+
+
+class AnonymousResponseCacheMixin:
+    """Кеширует list/retrieve для анонимов и отвечает 304 по ETag.
+
+    Ключ включает версию данных, которую сигналы меняют после
+    сохранения рецептов, ингредиентов и авторов.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(
+            super().alist, request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(
+            super().aretrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        version = recipes_version()
+        key, etag, last_modified = self.validators(request, version)
+        response = self.conditional_response(request, etag, last_modified)
+        if response is None:
+            data = cache.get(key)
+            if data is None:
+                with self.reads_for(version):
+                    response = handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cache.set(key, response.data,
+                          settings.RECIPES_RESPONSE_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+        return self.with_validators(response, etag, last_modified)
+
+    async def acached_response(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return await handler(request, *args, **kwargs)
+        version = await arecipes_version()
+        key, etag, last_modified = self.validators(request, version)
+        response = self.conditional_response(request, etag, last_modified)
+        if response is None:
+            data = await cache.aget(key)
+            if data is None:
+                with self.reads_for(version):
+                    response = await handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                await cache.aset(key, response.data,
+                                 settings.RECIPES_RESPONSE_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+        return self.with_validators(response, etag, last_modified)
+
+    def reads_for(self, version):
+        # Реплика может ещё не видеть недавнее изменение, а ответ
+        # закешируется под новой версией
+        if time.time() - version < settings.REPLICA_PIN_SECONDS:
+            return primary()
+        return nullcontext()
+
+    def validators(self, request, version):
+        """Ключ кеша, ETag и Last-Modified для версии данных.
+
+        Last-Modified точен до секунды, поэтому отдаётся, только когда
+        секунда версии прошла: следующая версия будет позже неё.
+        """
+        digest = request_digest(request)
+        last_modified = int(version)
+        return (f'recipes:response:{version}:{digest}',
+                f'"{digest}-{version}"',
+                last_modified if last_modified < int(time.time()) else None)
+
+    def conditional_response(self, request, etag, last_modified):
+        # Сначала ETag, If-Modified-Since — только для клиентов без него
+        if 'HTTP_IF_NONE_MATCH' in request.META:
+            last_modified = None
+        return get_conditional_response(
+            request._request, etag=etag, last_modified=last_modified)
+
+    def with_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        return response
@@ -0,0 +1,54 @@
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Recipe
+from .similar import INTERACTIONS
+
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def load_events():
+    """id рецептов, веса и возраст событий в днях."""
+    now = timezone.now().timestamp()
+    recipe_ids, weights, ages = [], [], []
+    for model, weight in INTERACTIONS:
+        for recipe_id, created in model.objects.order_by().values_list(
+                'recipe_id', 'created').iterator(chunk_size=10000):
+            recipe_ids.append(recipe_id)
+            weights.append(weight)
+            ages.append((now - created.timestamp()) / SECONDS_PER_DAY)
+    return (np.array(recipe_ids, dtype=np.int64), np.array(weights),
+            np.clip(np.array(ages), 0, None))
+
+
+def compute_scores(recipe_ids, weights, ages):
+    """Сумма весов событий с экспоненциальным затуханием по рецептам."""
+    unique_ids, positions = np.unique(recipe_ids, return_inverse=True)
+    return unique_ids, {
+        field: np.bincount(
+            positions, weights=weights * np.exp2(-ages / half_life),
+            minlength=len(unique_ids))
+        for field, half_life in settings.RECIPE_SCORE_HALF_LIFE_DAYS.items()
+    }
+
+
+def store_scores(recipe_ids, scores, batch_size):
+    """Записывает оценки и обнуляет рецепты, у которых событий нет."""
+    fields = tuple(scores)
+    Recipe.objects.bulk_update(
+        (Recipe(pk=int(pk), **{
+            field: float(scores[field][position]) for field in fields})
+         for position, pk in enumerate(recipe_ids)),
+        fields, batch_size=batch_size
+    )
+    stale = Q()
+    for field in fields:
+        stale |= Q(**{f'{field}__gt': 0})
+    stale_ids = set(Recipe.objects.filter(stale).values_list(
+        'pk', flat=True)) - set(recipe_ids.tolist())
+    Recipe.objects.filter(pk__in=stale_ids).update(
+        **dict.fromkeys(fields, 0))
+    return len(stale_ids)
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import re
+import threading
+import uuid
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Length
+
+from .models import Ingredient, Recipe
+
+
+# Совпадает с конфигурацией триггера из миграции 0008
+RECIPE_SEARCH_CONFIG = 'russian'
+
+
+def normalize(text):
+    return text.strip().lower().replace('ё', 'е')
+
+
+def bigrams(word):
+    return {word[i:i + 2] for i in range(len(word) - 1)}
+
+
+def prefix_distance(query, word, limit):
+    """Наименьшее расстояние Левенштейна от query до начала word.
+
+    Расчёт прекращается, как только расстояние заведомо больше limit.
+    """
+    if len(word) < len(query) - limit:
+        return limit + 1
+    word = word[:len(query) + limit]
+    previous = list(range(len(word) + 1))
+    for i, query_char in enumerate(query, start=1):
+        current = [i]
+        for j, word_char in enumerate(word, start=1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (query_char != word_char)
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[max(len(query) - limit, 0):])
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов в памяти процесса.
+
+    Версия индекса хранится в общем кеше: при изменении ингредиентов
+    её меняют, и каждый процесс перестраивает свою копию при следующем
+    обращении.
+    """
+
+    VERSION_KEY = 'ingredients:index:version'
+    MIN_FUZZY_LENGTH = 3
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self.rows = []
+        self.etag = None
+        self._names = []
+        self._sorted = []
+        self._words = {}
+        self._bigrams = {}
+
+    def _current_version(self):
+        return cache.get_or_set(self.VERSION_KEY, uuid.uuid4().hex, None)
+
+    def invalidate(self):
+        cache.set(self.VERSION_KEY, uuid.uuid4().hex, None)
+
+    def rebuild(self, version=None):
+        with self._lock:
+            version = version or self._current_version()
+            # Реплика может ещё не видеть изменение, о котором сообщила
+            # версия, поэтому индекс строится по основной БД
+            rows = list(Ingredient.objects.using(DEFAULT_DB_ALIAS).order_by(
+                'name', 'id').values('id', 'name', 'measurement_unit'))
+            self._names = [normalize(row['name']) for row in rows]
+            self._sorted = sorted(
+                (name, position) for position, name in enumerate(self._names)
+            )
+            # Слова названий и биграммный индекс по ним для поиска с опечатками
+            words = defaultdict(set)
+            for position, name in enumerate(self._names):
+                for word in name.split():
+                    words[word].add(position)
+            postings = defaultdict(list)
+            for word in words:
+                for bigram in bigrams(word):
+                    postings[bigram].append(word)
+            self._words = dict(words)
+            self._bigrams = dict(postings)
+            self.rows = rows
+            self.etag = '"{}"'.format(hashlib.md5(
+                json.dumps(rows, ensure_ascii=False).encode()
+            ).hexdigest())
+            self._version = version
+
+    def ensure_fresh(self):
+        version = self._current_version()
+        if version != self._version:
+            self.rebuild(version)
+        return self
+
+    async def aensure_fresh(self):
+        version = await cache.aget_or_set(
+            self.VERSION_KEY, uuid.uuid4().hex, None)
+        if version != self._version:
+            await sync_to_async(self.rebuild)(version)
+        return self
+
+    def search(self, query):
+        return self.ensure_fresh().lookup(query)
+
+    async def asearch(self, query):
+        return (await self.aensure_fresh()).lookup(query)
+
+    def lookup(self, query):
+        """Сначала совпадения по началу, затем вхождения, затем опечатки."""
+        query = normalize(query)
+        if not query:
+            return self.rows
+        start = bisect_left(self._sorted, (query,))
+        prefix = []
+        for name, position in self._sorted[start:]:
+            if not name.startswith(query):
+                break
+            prefix.append(position)
+        found = set(prefix)
+        substring = sorted(
+            (name.find(query), position)
+            for position, name in enumerate(self._names)
+            if position not in found and query in name
+        )
+        positions = prefix + [position for _, position in substring]
+        if not positions and len(query) >= self.MIN_FUZZY_LENGTH:
+            positions = self._fuzzy(query)
+        return [self.rows[position] for position in positions]
+
+    def _fuzzy(self, query):
+        limit = 1 if len(query) < 8 else 2
+        query_bigrams = bigrams(query)
+        # Каждая правка портит не больше двух биграмм запроса
+        threshold = max(1, len(query_bigrams) - 2 * limit)
+        shared = Counter(
+            word
+            for bigram in query_bigrams
+            for word in self._bigrams.get(bigram, ())
+        )
+        distances = {}
+        for word, count in shared.items():
+            if count < threshold:
+                continue
+            distance = prefix_distance(query, word, limit)
+            if distance > limit:
+                continue
+            for position in self._words[word]:
+                distances[position] = min(
+                    distance, distances.get(position, distance))
+        return sorted(distances, key=lambda position: (
+            distances[position], position))
+
+
+ingredient_index = IngredientIndex()
+
+
+def search_words(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def is_postgresql(queryset):
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def name_query(words, prefix=False):
+    """Все слова в названии (вес A); последнее — начало слова, если prefix.
+
+    Слова из search_words состоят только из \\w, экранировать нечего.
+    """
+    terms = [f'{word}:A' for word in words]
+    if prefix:
+        terms[-1] = f'{words[-1]}:*A'
+    return SearchQuery(' & '.join(terms), search_type='raw',
+                       config=RECIPE_SEARCH_CONFIG)
+
+
+def rank_candidates(queryset, query, in_name):
+    """Ранжирует совпадения с query, не считая ранг для всех рецептов.
+
+    Из GIN-индекса без сортировки берутся до RECIPE_SEARCH_MAX_RESULTS
+    совпадений в названии (запрос in_name) и столько же любых других.
+    Совпадение в названии весит больше, поэтому лучшие результаты
+    почти всегда среди первых; по частому слову, которое есть в
+    названиях многих рецептов, часть совпадений не ранжируется.
+    """
+    limit = settings.RECIPE_SEARCH_MAX_RESULTS
+    matches = queryset.filter(search_vector=query).order_by().values('pk')
+    return queryset.filter(pk__in=matches.filter(
+        search_vector=in_name)[:limit].union(matches[:limit])
+    ).annotate(
+        search_rank=SearchRank(F('search_vector'), query)
+    ).order_by('-search_rank', 'id')
+
+
+def required_words(query):
+    """Слова запроса в синтаксисе websearch, кроме исключённых «-слово»
+    и оператора or."""
+    return [word for token in query.split() if not token.startswith('-')
+            for word in search_words(token) if word != 'or']
+
+
+def search_recipes(queryset, query):
+    """Рецепты по запросу из ?search=, самые релевантные первыми."""
+    words = search_words(query)
+    if not words:
+        return queryset
+    if is_postgresql(queryset):
+        return rank_candidates(queryset, SearchQuery(
+            query, search_type='websearch', config=RECIPE_SEARCH_CONFIG
+        ), name_query(required_words(query) or words))
+    # SQLite: все слова в названии или описании, совпадения
+    # в названии выше
+    in_name = Q()
+    for word in words:
+        in_name &= contains('name', word)
+        queryset = queryset.filter(
+            contains('name', word) | contains('text', word))
+    return queryset.annotate(search_rank=Case(
+        When(in_name, then=Value(1.0)), default=Value(0.0)
+    )).order_by('-search_rank', 'id')
+
+
+def contains(field, word, lookup='contains'):
+    """LIKE в SQLite не сравнивает кириллицу без учёта регистра,
+    поэтому проверяем слово и его вариант с заглавной буквы."""
+    return (Q(**{f'{field}__{lookup}': word})
+            | Q(**{f'{field}__{lookup}': word.capitalize()}))
+
+
+def suggest_recipes(query):
+    """Названия для подсказок: последнее слово запроса — начало слова."""
+    words = search_words(query)
+    if len(''.join(words)) < settings.RECIPE_SUGGESTIONS_MIN_LENGTH:
+        return []
+    recipes = Recipe.objects.all()
+    if is_postgresql(recipes):
+        # Слова состоят только из \w, так что экранировать нечего
+        recipes = rank_candidates(recipes, SearchQuery(
+            ' & '.join(words) + ':*', search_type='raw',
+            config=RECIPE_SEARCH_CONFIG), name_query(words, prefix=True))
+    else:
+        for word in words[:-1]:
+            recipes = recipes.filter(contains('name', word))
+        recipes = recipes.filter(
+            contains('name', words[-1], 'startswith')
+            | Q(name__contains=f' {words[-1]}')
+        ).order_by(Length('name'), 'id')
+    return list(recipes.values('id', 'name')[
+        :settings.RECIPE_SUGGESTIONS_LIMIT])
@@ -1,16 +1,22 @@
 from rest_framework import serializers
 from djoser.serializers import UserSerializer
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from drf_extra_fields.fields import Base64ImageField
-from .models import Recipe, Ingredient, RecipeIngredient, Subscription
+from .images import variant_urls
+from .membership import get_membership
+from .metrics import TimedSerializerMixin
+from .models import Recipe, Ingredient, RecipeIngredient
 
 
 User = get_user_model()
 
 
-class UserDetailSerializer(UserSerializer):
+class UserDetailSerializer(TimedSerializerMixin, UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
     avatar = serializers.ImageField(required=False, allow_null=True)
+    avatar_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -22,37 +28,48 @@ class UserDetailSerializer(UserSerializer):
             'last_name',
             'is_subscribed',
             'avatar',
+            'avatar_variants',
         )
         read_only_fields = fields
 
+    def get_avatar_variants(self, user_obj):
+        return variant_urls(self.context.get('request'), user_obj.avatar,
+                            user_obj.avatar_variants)
+
     def get_is_subscribed(self, user_obj):
+        # Признак может быть уже аннотирован во вьюсете
+        if hasattr(user_obj, 'is_subscribed'):
+            return user_obj.is_subscribed
         request = self.context.get('request')
-        return (
+        return bool(
             request
-            and request.user.is_authenticated
-            and Subscription.objects.filter(
-                user=request.user, author=user_obj).exists()
+            and user_obj.pk in get_membership(request).subscriptions
         )
 
 
 class UserWithSubscriptionsSerializer(UserDetailSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(source='recipes.count')
 
     class Meta:
         model = User
         fields = (
             'id', 'email', 'username', 'first_name', 'last_name',
-            'recipes', 'recipes_count', 'avatar', 'is_subscribed'
+            'recipes', 'recipes_count', 'avatar', 'avatar_variants',
+            'is_subscribed'
         )
         read_only_fields = fields
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        limit = request.query_params.get('recipes_limit') if request else None
-        recipes = obj.recipes.all()
-        if limit and limit.isdigit():
-            recipes = recipes[:int(limit)]
+        if hasattr(obj, 'preview_recipes'):
+            # Уже ограничены по recipes_limit во вьюсете
+            recipes = obj.preview_recipes
+        else:
+            limit = (request.query_params.get('recipes_limit')
+                     if request else None)
+            recipes = obj.recipes.all()
+            if limit and limit.isdigit():
+                recipes = recipes[:int(limit)]
 
         return ShortRecipeSerializer(
             recipes, many=True,
@@ -72,7 +89,8 @@ class AvatarUpdateSerializer(serializers.Serializer):
         return instance
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
@@ -91,9 +109,8 @@ class IngredientInRecipeReadSerializer(serializers.ModelSerializer):
 
 
 class IngredientWriteSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    # Существование id проверяется одним запросом для всего рецепта
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(min_value=1)
 
     class Meta:
@@ -101,37 +118,59 @@ class IngredientWriteSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     author = UserDetailSerializer(read_only=True)
     ingredients = IngredientInRecipeReadSerializer(
         source='recipe_ingredients', many=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
+            'is_in_shopping_cart', 'name', 'image', 'image_variants', 'text',
+            'cooking_time'
         )
         read_only_fields = fields
 
+    def get_image_variants(self, recipe_obj):
+        return variant_urls(self.context.get('request'), recipe_obj.image,
+                            recipe_obj.image_variants)
+
     def get_is_favorited(self, recipe_obj):
-        user = self.context.get('request').user
-        return (user.is_authenticated
-                and recipe_obj.favorites.filter(user=user).exists())
+        membership = get_membership(self.context.get('request'))
+        return recipe_obj.pk in membership.favorites
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            return obj.in_carts.filter(user=user).exists()
-        return False
+        membership = get_membership(self.context.get('request'))
+        return obj.pk in membership.shopping_cart
+
 
+class ShortRecipeSerializer(TimedSerializerMixin,
+                            serializers.ModelSerializer):
+    image_variants = serializers.SerializerMethodField()
 
-class ShortRecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+        read_only_fields = fields
+
+    def get_image_variants(self, recipe_obj):
+        return variant_urls(self.context.get('request'), recipe_obj.image,
+                            recipe_obj.image_variants)
+
+
+class PantryRecipeSerializer(ShortRecipeSerializer):
+    """Рецепт в подборе по имеющимся продуктам."""
+
+    coverage = serializers.FloatField()
+    missing = serializers.IntegerField()
+
+    class Meta(ShortRecipeSerializer.Meta):
+        fields = ShortRecipeSerializer.Meta.fields + ('coverage', 'missing')
         read_only_fields = fields
 
 
@@ -162,22 +201,57 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         if len(ids) != len(set(ids)):
             raise serializers.ValidationError(
                 'Ингредиенты не должны повторяться.')
+        missing = set(ids) - set(
+            Ingredient.objects.filter(id__in=ids)
+            .values_list('id', flat=True))
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиентов с id '
+                f'{", ".join(map(str, sorted(missing)))} не существует.')
         return ingredients
 
     def validate(self, attrs):
-        ingredients = attrs.get('ingredients')
-        self.validate_ingredients(ingredients)
+        # При PATCH поле может отсутствовать, но оно обязательно
+        if not attrs.get('ingredients'):
+            raise serializers.ValidationError(
+                'Нужно добавить хотя бы один ингредиент.')
         return attrs
 
     def create_ingredients(self, ingredients_data, recipe):
         RecipeIngredient.objects.bulk_create(
             [RecipeIngredient(
                 recipe=recipe,
-                ingredient=item['id'],
+                ingredient_id=item['id'],
                 amount=item['amount']
             ) for item in ingredients_data]
         )
 
+    def update_ingredients(self, ingredients_data, recipe):
+        """Меняет только добавленные, удалённые и изменённые строки."""
+        amounts = {item['id']: item['amount'] for item in ingredients_data}
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in recipe.recipe_ingredients.all()
+        }
+        removed = [recipe_ingredient.pk
+                   for ingredient_id, recipe_ingredient in current.items()
+                   if ingredient_id not in amounts]
+        changed = []
+        for ingredient_id, recipe_ingredient in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        added = [item for item in ingredients_data
+                 if item['id'] not in current]
+        if removed:
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        if added:
+            self.create_ingredients(added, recipe)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         validated_data['author'] = self.context['request'].user
@@ -185,16 +259,20 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         self.create_ingredients(ingredients_data, recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         # Извлекаем ингредиенты, если они есть в запросе
         ingredients_data = validated_data.pop('ingredients')
         # Обновляем всё, кроме ингредиентов
         updated_instance = super().update(instance, validated_data)
-        # Очистить старые ингредиенты
-        updated_instance.ingredients.clear()
-        # Создать новые связи
-        self.create_ingredients(ingredients_data, updated_instance)
+        # Применяем только разницу со старым составом
+        self.update_ingredients(ingredients_data, updated_instance)
         return updated_instance
 
     def to_representation(self, instance):
+        # Состав мог измениться: загружаем его заново одним запросом
+        prefetch_related_objects([instance], Prefetch(
+            'recipe_ingredients',
+            queryset=RecipeIngredient.objects.select_related('ingredient')
+        ))
         return RecipeReadSerializer(instance, context=self.context).data
@@ -0,0 +1,157 @@
+import asyncio
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Sum
+
+from .models import Recipe, RecipeIngredient
+
+
+# Под ASGI вёрстка PDF уходит в этот пул, чтобы не занимать цикл
+# событий; размер пула ограничивает число одновременных вёрсток
+pdf_executor = ThreadPoolExecutor(
+    max_workers=settings.SHOPPING_LIST_PDF_WORKERS,
+    thread_name_prefix='shopping-list-pdf'
+)
+
+
+def get_ingredients(user):
+    """Суммарное количество каждого ингредиента из корзины одним запросом."""
+    return (RecipeIngredient.objects
+            .filter(recipe__in_carts__user=user)
+            .values('ingredient__name', 'ingredient__measurement_unit')
+            .annotate(amount=Sum('amount'))
+            .order_by('ingredient__name', 'ingredient__measurement_unit')
+            .values_list('ingredient__name', 'amount',
+                         'ingredient__measurement_unit')
+            .iterator())
+
+
+def get_recipes(user):
+    return (Recipe.objects
+            .filter(in_carts__user=user)
+            .values_list('name', 'author__username')
+            .iterator())
+
+
+def header_lines(user):
+    return (
+        f'Список покупок для пользователя: {user.get_full_name()}',
+        f'Дата: {datetime.now().strftime("%d.%m.%Y")}',
+    )
+
+
+def text_lines(user):
+    yield from header_lines(user)
+    yield ''
+    yield 'Необходимые ингредиенты:'
+    for idx, (name, amount, unit) in enumerate(get_ingredients(user),
+                                               start=1):
+        yield f'{idx}. {name.capitalize()} — {amount} {unit}'
+    yield ''
+    yield 'Рецепты в корзине:'
+    for name, author in get_recipes(user):
+        yield f'- {name} (автор: {author})'
+
+
+def render_txt(user):
+    for line in text_lines(user):
+        yield f'{line}\n'
+
+
+class Echo:
+    """Псевдобуфер: csv.writer сразу отдаёт записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(user):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for name, amount, unit in get_ingredients(user):
+        yield writer.writerow((name, amount, unit))
+    yield writer.writerow(())
+    yield writer.writerow(('Рецепт', 'Автор'))
+    for row in get_recipes(user):
+        yield writer.writerow(row)
+
+
+def build_pdf(lines):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import simpleSplit
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+
+    font = 'ShoppingListFont'
+    if font not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(font, settings.SHOPPING_LIST_PDF_FONT))
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    margin, leading = 50, 16
+    y = height - margin
+    pdf.setFont(font, 11)
+    for line in lines:
+        # Длинная строка переносится по словам в ширину страницы
+        for part in simpleSplit(line, font, 11, width - 2 * margin) or ['']:
+            if y < margin:
+                pdf.showPage()
+                pdf.setFont(font, 11)
+                y = height - margin
+            pdf.drawString(margin, y, part)
+            y -= leading
+    pdf.save()
+    return buffer.getvalue()
+
+
+def render_pdf(user):
+    # reportlab отдаёт документ только целиком, поэтому PDF — одна часть
+    # ответа. Под WSGI воркер всё равно занят запросом: вёрстка идёт
+    # в нём, строки читаются из БД по ходу вёрстки
+    yield build_pdf(text_lines(user))
+
+
+async def arender_pdf(user):
+    """PDF под ASGI: строки читаются в потоке запроса, вёрстка — в пуле."""
+    lines = await sync_to_async(list)(text_lines(user))
+    yield await asyncio.get_running_loop().run_in_executor(
+        pdf_executor, build_pdf, lines)
+
+
+async def aiterate(chunks):
+    """Синхронный генератор как асинхронный, по одной части за раз.
+
+    Синхронный итератор потокового ответа Django под ASGI сначала
+    собирает в список, а этот отдаёт части по мере готовности. Части
+    читаются в потоке запроса, где открыто соединение с БД.
+    """
+    chunks = iter(chunks)
+    end = object()
+    while (chunk := await sync_to_async(next)(chunks, end)) is not end:
+        yield chunk
+
+
+RENDERERS = {
+    'txt': render_txt,
+    'csv': render_csv,
+    'pdf': render_pdf,
+}
+ASYNC_RENDERERS = {
+    'pdf': arender_pdf,
+}
+
+
+def render(format, user, asgi=False):
+    """Части файла в формате format: под ASGI — асинхронный итератор."""
+    if not asgi:
+        return RENDERERS[format](user)
+    if format in ASYNC_RENDERERS:
+        return ASYNC_RENDERERS[format](user)
+    return aiterate(RENDERERS[format](user))
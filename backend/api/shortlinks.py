@@ -0,0 +1,145 @@
+import hashlib
+import hmac
+import string
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ShortLink
+
+
+# Отметка «такого кода нет» для отрицательного кеширования
+MISSING = ''
+
+# Коды рецептов: id, перемешанный ключевой сетью Фейстеля на 48 битах
+# и записанный в base62 фиксированной длины. Старые случайные коды
+# состоят из 7 символов, так что схемы не пересекаются.
+ALPHABET = string.digits + string.ascii_letters
+RECIPE_SLUG_LENGTH = 9
+HALF_BITS = 24
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+
+class LocalLRUCache:
+    """Небольшой LRU-кеш процесса с временем жизни записей."""
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.timeout)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_links = LocalLRUCache(
+    settings.SHORT_LINK_LOCAL_CACHE_SIZE,
+    settings.SHORT_LINK_LOCAL_CACHE_TIMEOUT
+)
+
+
+def _round(key, number, half):
+    digest = hmac.new(
+        key, f'{number}:{half}'.encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:3], 'big')
+
+
+def _permute(value, rounds):
+    key = settings.SHORT_LINK_SECRET.encode()
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for number in rounds:
+        left, right = right, left ^ _round(key, number, right)
+    return right << HALF_BITS | left
+
+
+def encode_recipe_slug(recipe_id):
+    value = _permute(int(recipe_id), range(ROUNDS))
+    chars = []
+    for _ in range(RECIPE_SLUG_LENGTH):
+        value, digit = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def decode_recipe_slug(slug):
+    """id рецепта по коду или None, если это не код рецепта."""
+    if len(slug) != RECIPE_SLUG_LENGTH:
+        return None
+    value = 0
+    for char in slug:
+        digit = ALPHABET.find(char)
+        if digit < 0:
+            return None
+        value = value * len(ALPHABET) + digit
+    if value >> 2 * HALF_BITS:
+        return None
+    return _permute(value, reversed(range(ROUNDS)))
+
+
+def slug_key(slug):
+    return f'shortlinks:slug:{slug}'
+
+
+def resolve_short_link(slug):
+    """Адрес по старому случайному коду: кеш процесса, общий кеш, БД."""
+    url = local_links.get(slug)
+    if url is None:
+        url = cache.get(slug_key(slug))
+        if url is None:
+            url = (ShortLink.objects.filter(slug=slug)
+                   .values_list('original_url', flat=True).first()
+                   or MISSING)
+            cache.set(slug_key(slug), url, cache_timeout(url))
+        local_links.set(slug, url)
+    return url or None
+
+
+async def aresolve_short_link(slug):
+    url = local_links.get(slug)
+    if url is None:
+        url = await cache.aget(slug_key(slug))
+        if url is None:
+            url = (await ShortLink.objects.filter(slug=slug)
+                   .values_list('original_url', flat=True).afirst()
+                   or MISSING)
+            await cache.aset(slug_key(slug), url, cache_timeout(url))
+        local_links.set(slug, url)
+    return url or None
+
+
+def cache_timeout(url):
+    return settings.SHORT_LINK_MISSING_TIMEOUT if url == MISSING else None
+
+
+def forget_short_link(short_link):
+    local_links.delete(short_link.slug)
+    cache.delete(slug_key(short_link.slug))
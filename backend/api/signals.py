@@ -0,0 +1,150 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.fields.files import FieldFile
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .counters import COUNTERS, change_counter
+from .feed import backfill, fan_out, forget_author
+from .images import schedule_variants
+from .membership import KINDS, invalidate_membership
+from .metrics import record_query
+from .models import (
+    Ingredient, Recipe, RecipeIngredient, ShortLink, Subscription, User
+)
+from .pantry import pantry_index
+from .response_cache import bump_recipes_version
+from .search import ingredient_index
+from .shortlinks import forget_short_link
+
+
+@receiver(connection_created)
+def instrument_connection(connection, **kwargs):
+    # В начало списка: execute_wrapper() снимает обёртки с конца
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def update_pantry_index(instance, **kwargs):
+    # Состав сохраняется после рецепта, но в той же транзакции
+    transaction.on_commit(partial(pantry_index.changed, (instance.pk,)))
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(instance, created, **kwargs):
+    if created:
+        transaction.on_commit(partial(fan_out, (instance.pk,)))
+
+
+@receiver(post_save, sender=Subscription)
+def backfill_feed(instance, created, **kwargs):
+    if created:
+        transaction.on_commit(
+            partial(backfill, instance.user_id, instance.author_id))
+
+
+@receiver(post_delete, sender=Subscription)
+def clean_feed(instance, **kwargs):
+    forget_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Ingredient)
+def rebuild_pantry_index(**kwargs):
+    # Каскадное удаление затрагивает неизвестно какие рецепты
+    transaction.on_commit(pantry_index.invalidate)
+
+
+@receiver((post_save, post_delete), sender=ShortLink)
+def invalidate_short_link(instance, **kwargs):
+    forget_short_link(instance)
+
+
+def connect_counter(model, field, related_model, foreign_key):
+    attname = related_model._meta.get_field(foreign_key).attname
+
+    def on_save(instance, created, **kwargs):
+        if created:
+            change_counter(model, getattr(instance, attname), field, 1)
+
+    def on_delete(instance, **kwargs):
+        change_counter(model, getattr(instance, attname), field, -1)
+
+    uid = f'{field}:{related_model.__name__}.{foreign_key}'
+    post_save.connect(on_save, sender=related_model, weak=False,
+                      dispatch_uid=uid)
+    post_delete.connect(on_delete, sender=related_model, weak=False,
+                        dispatch_uid=uid)
+
+
+for counter in COUNTERS:
+    connect_counter(*counter)
+
+
+def invalidate_user_membership(sender, instance, **kwargs):
+    transaction.on_commit(
+        partial(invalidate_membership, sender, instance.user_id))
+
+
+# Поля пользователя, которые видны в кешируемых ответах
+USER_PROFILE_FIELDS = frozenset((
+    'email', 'username', 'first_name', 'last_name', 'avatar',
+    'avatar_variants',
+))
+
+
+def profile_value(user, name):
+    value = getattr(user, name)
+    # Файл хранится в БД под своим именем, пустой — как ''
+    return str(value) if isinstance(value, FieldFile) else value
+
+
+@receiver(pre_save, sender=User)
+def detect_profile_change(instance, update_fields=None, using=None,
+                          **kwargs):
+    if instance._state.adding:
+        instance._profile_changed = True
+        return
+    # Вход, смена пароля и прочие служебные сохранения профиль не меняют
+    fields = USER_PROFILE_FIELDS & (update_fields or USER_PROFILE_FIELDS)
+    if not fields:
+        instance._profile_changed = False
+        return
+    saved = User.objects.using(using).filter(
+        pk=instance.pk).values(*fields).first()
+    instance._profile_changed = saved is None or any(
+        profile_value(instance, name) != value
+        for name, value in saved.items())
+
+
+def invalidate_recipe_responses(sender, instance, signal, **kwargs):
+    if signal is post_save and not getattr(
+            instance, '_profile_changed', True):
+        return
+    transaction.on_commit(bump_recipes_version)
+
+
+# Подписываемся на конкретные модели: приёмник без sender отключил бы
+# быстрое удаление (без предварительного SELECT) для всех моделей
+for signal in (post_save, post_delete):
+    for model in KINDS:
+        signal.connect(invalidate_user_membership, sender=model)
+    for model in (Recipe, RecipeIngredient, Ingredient, User):
+        signal.connect(invalidate_recipe_responses, sender=model)
+
+
+@receiver(post_save, sender=Recipe)
+def build_recipe_image_variants(instance, **kwargs):
+    schedule_variants(instance, 'image')
+
+
+@receiver(post_save, sender=User)
+def build_avatar_variants(instance, **kwargs):
+    schedule_variants(instance, 'avatar')
@@ -0,0 +1,83 @@
+import numpy as np
+from django.db import transaction
+from scipy import sparse
+
+from .models import Favorite, RecipeSimilarity, ShoppingCart
+
+
+# Связь пользователя с рецептом и её вес в матрице
+INTERACTIONS = (
+    (Favorite, 1.0),
+    (ShoppingCart, 0.5),
+)
+
+
+def interaction_matrix():
+    """Разреженная матрица «пользователь × рецепт» по всем связям.
+
+    Возвращает матрицу CSC, id пользователей строк и id рецептов
+    столбцов.
+    """
+    pairs = [
+        np.array(list(model.objects.order_by().values_list(
+            'user_id', 'recipe_id')), dtype=np.int64).reshape(-1, 2)
+        for model, _ in INTERACTIONS
+    ]
+    weights = np.concatenate([
+        np.full(len(rows), weight) for rows, (_, weight)
+        in zip(pairs, INTERACTIONS)
+    ])
+    pairs = np.concatenate(pairs)
+    user_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    recipe_ids, columns = np.unique(pairs[:, 1], return_inverse=True)
+    # Повторы (избранное и корзина сразу) складываются
+    matrix = sparse.csc_matrix(
+        (weights, (rows, columns)), shape=(len(user_ids), len(recipe_ids)))
+    return matrix, user_ids, recipe_ids
+
+
+def columns_of_users(matrix, user_ids, users):
+    """Столбцы всех рецептов, связанных с пользователями users."""
+    rows = np.flatnonzero(np.isin(user_ids, list(users)))
+    return np.unique(matrix.tocsr()[rows].indices)
+
+
+def column_norms(matrix):
+    return np.sqrt(matrix.multiply(matrix).sum(axis=0)).A1
+
+
+def top_neighbours(matrix, norms, columns, top_k):
+    """Для каждого столбца — top_k ближайших по косинусу столбцов.
+
+    Совместная встречаемость считается только для строк columns:
+    A[:, columns].T @ A, так что вся матрица R × R не строится.
+    """
+    cooccurrence = (matrix[:, columns].T @ matrix).tocsr()
+    for position, column in enumerate(columns):
+        start, end = cooccurrence.indptr[position:position + 2]
+        neighbours = cooccurrence.indices[start:end]
+        scores = cooccurrence.data[start:end] / (
+            norms[column] * norms[neighbours])
+        scores[neighbours == column] = 0
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+            neighbours, scores = neighbours[best], scores[best]
+        keep = scores > 0
+        yield column, neighbours[keep], scores[keep]
+
+
+def store_neighbours(matrix, norms, recipe_ids, columns, top_k):
+    """Заменяет соседей рецептов columns одной транзакцией."""
+    rows = [
+        RecipeSimilarity(recipe_id=int(recipe_ids[column]),
+                         similar_id=int(recipe_ids[neighbour]),
+                         score=round(float(score), 6))
+        for column, neighbours, scores in top_neighbours(
+            matrix, norms, columns, top_k)
+        for neighbour, score in zip(neighbours, scores)
+    ]
+    with transaction.atomic():
+        RecipeSimilarity.objects.filter(
+            recipe_id__in=recipe_ids[columns].tolist()).delete()
+        RecipeSimilarity.objects.bulk_create(rows)
+    return len(rows)
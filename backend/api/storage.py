@@ -0,0 +1,64 @@
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, называющее файлы по SHA-256 их содержимого.
+
+    Одинаковые файлы получают одно имя, поэтому повторная загрузка
+    того же изображения ничего не записывает на диск. Каталог из
+    upload_to сохраняется: recipe/images/ab/abcdef....jpg.
+
+    Один файл могут использовать несколько объектов, поэтому файлы
+    не удаляются вместе с объектом: их собирает collect_media_garbage.
+    """
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = posixpath.splitext(name)[1].lower()
+        return posixpath.join(
+            posixpath.dirname(name), digest[:2], f'{digest}{extension}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        try:
+            # Свежее время изменения не даёт collect_media_garbage
+            # удалить файл, который сохраняет незавершённая транзакция
+            os.utime(self.path(name))
+            return name
+        except FileNotFoundError:
+            return super().save(name, content, max_length=max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # Имя задаёт содержимое: существующий файл с ним — тот же файл
+        if max_length is not None and len(name) > max_length:
+            raise SuspiciousFileOperation(
+                f'Имя файла "{name}" длиннее {max_length} символов.')
+        return name
+
+    def _save(self, name, content):
+        # Файл пишется под временным именем и появляется под своим
+        # только целиком. Если его уже сохранил параллельный запрос,
+        # ссылка не создаётся (EEXIST) — это тоже успех
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        try:
+            os.link(self.path(temporary), self.path(name))
+        except FileExistsError:
+            os.utime(self.path(name))
+        finally:
+            os.remove(self.path(temporary))
+        return name
@@ -0,0 +1,1700 @@
+import asyncio
+import base64
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, router
+from django.http import HttpResponse
+from django.db.migrations.executor import MigrationExecutor
+from django.test import (
+    RequestFactory, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import (
+    APIRequestFactory, APITestCase, force_authenticate
+)
+
+from .models import (
+    FeedEntry, Favorite, Ingredient, Recipe, RecipeImport, RecipeIngredient,
+    RecipeSimilarityBuild, ShoppingCart, ShortLink, Subscription, User
+)
+from .images import build_variants, generate_variants
+from .membership import member_ids
+from .metrics import metrics
+from .pagination import LimitOffsetOrCursorPagination
+from .pantry import pantry_index
+from .replicas import current_replica, replica_middleware
+from .scores import compute_scores, load_events
+from .search import ingredient_index
+from .shopping_list import build_pdf
+from .shortlinks import (
+    decode_recipe_slug, encode_recipe_slug, local_links
+)
+from .views import IngredientViewSet, RecipeViewSet, UserViewSet
+
+
+class RecipeQueriesTest(APITestCase):
+    RECIPES_COUNT = 5
+    INGREDIENTS_PER_RECIPE = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Иван', last_name='Иванов', password='password'
+        )
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(cls.INGREDIENTS_PER_RECIPE)
+        )
+        for i in range(cls.RECIPES_COUNT):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {i}', text='Описание',
+                image='recipe/images/test.png', cooking_time=10
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=100)
+                for ingredient in ingredients
+            )
+        cls.recipe = Recipe.objects.first()
+        Favorite.objects.create(user=cls.user, recipe=cls.recipe)
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipe)
+        Subscription.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_list_queries_anonymous(self):
+        # count + рецепты с авторами + ингредиенты
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('recipe-list'))
+        self.assertEqual(len(response.data['results']), self.RECIPES_COUNT)
+
+    def test_list_queries_authenticated(self):
+        self.client.force_authenticate(self.user)
+        # Первый запрос загружает в кеш избранное, корзину и подписки
+        with self.assertNumQueries(6) as context:
+            self.client.get(reverse('recipe-list'))
+        for query in context.captured_queries[-3:]:
+            self.assertNotIn('JOIN', query['sql'])
+            self.assertNotIn('ORDER BY', query['sql'])
+        # Дальше столько же, сколько у анонима
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('recipe-list'))
+        recipe = next(item for item in response.data['results']
+                      if item['id'] == self.recipe.id)
+        self.assertTrue(recipe['is_favorited'])
+        self.assertTrue(recipe['is_in_shopping_cart'])
+        self.assertTrue(recipe['author']['is_subscribed'])
+        self.assertEqual(len(recipe['ingredients']),
+                         self.INGREDIENTS_PER_RECIPE)
+
+    def test_detail_queries_anonymous(self):
+        url = reverse('recipe-detail', args=(self.recipe.id,))
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertFalse(response.data['is_favorited'])
+        self.assertFalse(response.data['author']['is_subscribed'])
+
+    def test_detail_queries_authenticated(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('recipe-detail', args=(self.recipe.id,))
+        self.client.get(url)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertTrue(response.data['is_in_shopping_cart'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+
+    def test_flags_follow_changes(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('recipe-detail', args=(self.recipe.id,))
+        self.assertTrue(self.client.get(url).data['is_favorited'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(
+                reverse('recipe-favorite', args=(self.recipe.id,)))
+        self.assertFalse(self.client.get(url).data['is_favorited'])
+        response = self.client.get(
+            reverse('recipe-list'), {'is_favorited': 1})
+        self.assertEqual(response.data['count'], 0)
+
+    @override_settings(MEMBERSHIP_IN_LIST_LIMIT=0)
+    def test_large_membership_filtered_by_subquery(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('recipe-list')
+        for value, count in ((1, 1), (0, self.RECIPES_COUNT - 1)):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, {'is_favorited': value})
+            self.assertEqual(response.data['count'], count)
+            self.assertTrue(any('EXISTS' in query['sql']
+                                for query in context.captured_queries))
+
+
+class IngredientSearchTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('молоко', 'молоко топлёное', 'сгущённое молоко',
+                         'мука', 'мёд')
+        )
+
+    def setUp(self):
+        ingredient_index.invalidate()
+
+    def search(self, name):
+        response = self.client.get(reverse('ingredient-list'), {'name': name})
+        return [item['name'] for item in response.data]
+
+    def test_prefix_matches_go_first(self):
+        self.assertEqual(
+            self.search('мол'),
+            ['молоко', 'молоко топлёное', 'сгущённое молоко']
+        )
+
+    def test_typo_tolerant(self):
+        self.assertIn('молоко', self.search('малоко'))
+        self.assertEqual(self.search('мед'), ['мёд'])
+
+    def test_index_rebuilt_on_change(self):
+        self.assertEqual(self.search('сах'), [])
+        Ingredient.objects.create(name='сахар', measurement_unit='г')
+        self.assertEqual(self.search('сах'), ['сахар'])
+
+    def test_full_list_not_modified(self):
+        url = reverse('ingredient-list')
+        response = self.client.get(url)
+        self.assertEqual(len(response.data), 5)
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class ShoppingListDownloadTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Иван', last_name='Иванов', password='password'
+        )
+        milk, flour = Ingredient.objects.bulk_create((
+            Ingredient(name='молоко', measurement_unit='мл'),
+            Ingredient(name='мука', measurement_unit='г'),
+        ))
+        for i in range(10):
+            author = User.objects.create_user(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Автор', last_name=str(i), password='password'
+            )
+            recipe = Recipe.objects.create(
+                author=author, name=f'Блины {i}', text='Описание',
+                image='recipe/images/test.png', cooking_time=10
+            )
+            RecipeIngredient.objects.bulk_create((
+                RecipeIngredient(recipe=recipe, ingredient=milk, amount=100),
+                RecipeIngredient(recipe=recipe, ingredient=flour, amount=50),
+            ))
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def download(self, **params):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(
+            reverse('recipe-download-shopping-cart'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_txt_constant_queries(self):
+        with self.assertNumQueries(2):
+            response, content = self.download()
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = content.decode()
+        self.assertIn('1. Молоко — 1000 мл', text)
+        self.assertIn('2. Мука — 500 г', text)
+        self.assertIn('- Блины 9 (автор: author9)', text)
+
+    def test_csv(self):
+        response, content = self.download(format='csv')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        self.assertIn('молоко,1000,мл', content.decode())
+
+    def test_pdf(self):
+        response, content = self.download(format='pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+
+    def test_anonymous_forbidden(self):
+        response = self.client.get(reverse('recipe-download-shopping-cart'))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_streams_under_asgi(self):
+        token = await Token.objects.acreate(user=self.user)
+        response = await self.async_client.get(
+            reverse('recipe-download-shopping-cart'), {'format': 'csv'},
+            headers={'Authorization': f'Token {token.key}'})
+        # Синхронный итератор Django собрал бы в список целиком
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertGreater(len(chunks), 1)
+        self.assertIn('молоко,1000,мл', b''.join(chunks).decode())
+
+    async def test_pdf_does_not_block_event_loop(self):
+        token = await Token.objects.acreate(user=self.user)
+        threads = []
+
+        def slow_build_pdf(lines):
+            threads.append(threading.current_thread().name)
+            time.sleep(0.3)
+            return build_pdf(lines)
+
+        async def ticker():
+            ticks = 0
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+                if done.is_set():
+                    return ticks
+
+        done = asyncio.Event()
+        ticks = asyncio.create_task(ticker())
+        with mock.patch('api.shopping_list.build_pdf', slow_build_pdf):
+            response = await self.async_client.get(
+                reverse('recipe-download-shopping-cart'), {'format': 'pdf'},
+                headers={'Authorization': f'Token {token.key}'})
+            content = b''.join(
+                [chunk async for chunk in response.streaming_content])
+        done.set()
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertTrue(threads[0].startswith('shopping-list-pdf'))
+        # Пока пул верстает PDF, цикл событий продолжает работать
+        self.assertGreater(await ticks, 10)
+
+    def test_pdf_wraps_long_lines(self):
+        from reportlab.pdfgen.canvas import Canvas
+        with mock.patch.object(Canvas, 'drawString',
+                               autospec=True) as draw_string:
+            build_pdf(['слово ' * 200])
+        # Строка шире страницы выводится несколькими строками
+        self.assertGreater(draw_string.call_count, 1)
+
+
+class SubscriptionsQueriesTest(APITestCase):
+    AUTHORS_COUNT = 4
+    RECIPES_PER_AUTHOR = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Иван', last_name='Иванов', password='password'
+        )
+        for i in range(cls.AUTHORS_COUNT):
+            author = User.objects.create_user(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Автор', last_name=str(i), password='password'
+            )
+            for j in range(cls.RECIPES_PER_AUTHOR):
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {j}', text='Описание',
+                    image='recipe/images/test.png', cooking_time=10
+                )
+            Subscription.objects.create(user=cls.user, author=author)
+
+    def test_subscriptions_queries(self):
+        self.client.force_authenticate(self.user)
+        # count + авторы + превью рецептов
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                reverse('user-subscriptions'), {'recipes_limit': 2})
+        authors = response.data['results']
+        self.assertEqual(len(authors), self.AUTHORS_COUNT)
+        for author in authors:
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(author['recipes_count'], self.RECIPES_PER_AUTHOR)
+            self.assertEqual(
+                [recipe['name'] for recipe in author['recipes']],
+                ['Рецепт 0', 'Рецепт 1']
+            )
+
+
+class CursorPaginationTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        # Повторяющиеся названия проверяют второй ключ сортировки
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {i % 3}', text='Описание',
+                   image='recipe/images/test.png', cooking_time=10)
+            for i in range(7)
+        )
+
+    def test_cursor_walks_all_recipes_without_count(self):
+        url = reverse('recipe-list')
+        params = {'cursor': '', 'limit': 3}
+        seen = []
+        while url:
+            # рецепты + ингредиенты, без COUNT(*)
+            with self.assertNumQueries(2):
+                response = self.client.get(url, params)
+            self.assertNotIn('count', response.data)
+            seen.extend(recipe['id'] for recipe in response.data['results'])
+            url, params = response.data['next'], None
+        self.assertEqual(
+            seen,
+            list(Recipe.objects.order_by('name', 'id')
+                 .values_list('id', flat=True))
+        )
+
+    def test_limit_offset_still_supported(self):
+        response = self.client.get(
+            reverse('recipe-list'), {'limit': 3, 'offset': 3})
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('recipe-list'), {'cursor': 'xx'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_values_of_wrong_type(self):
+        paginator = LimitOffsetOrCursorPagination()
+        cases = (
+            ('recipe-list', {}, ['x', 'y']),
+            ('recipe-list', {}, [None, None]),
+            ('recipe-list', {'ordering': 'popular'}, ['x', 1]),
+            ('user-list', {}, [None]),
+        )
+        for view_name, params, position in cases:
+            with self.subTest(view_name=view_name, position=position):
+                response = self.client.get(reverse(view_name), {
+                    **params, 'cursor': paginator.encode_cursor(position)})
+                self.assertEqual(response.status_code, 404)
+        # Совместимые значения приводятся к типу поля
+        response = self.client.get(reverse('recipe-list'), {
+            'cursor': paginator.encode_cursor(['Рецепт 1', '1'])})
+        self.assertEqual(response.status_code, 200)
+
+
+class ShortLinkTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Описание',
+            image='recipe/images/test.png', cooking_time=10
+        )
+
+    def setUp(self):
+        cache.clear()
+        local_links.clear()
+
+    def test_recipe_slug_roundtrip(self):
+        for recipe_id in (1, 2, 12345, 2 ** 40):
+            slug = encode_recipe_slug(recipe_id)
+            self.assertEqual(len(slug), 9)
+            self.assertEqual(decode_recipe_slug(slug), recipe_id)
+        self.assertNotEqual(encode_recipe_slug(1)[:-1],
+                            encode_recipe_slug(2)[:-1])
+
+    def test_get_link_writes_nothing(self):
+        url = reverse('recipe-get-link', args=(self.recipe.id,))
+        with self.assertNumQueries(1):
+            link = self.client.get(url).data['short-link']
+        self.assertEqual(ShortLink.objects.count(), 0)
+        with self.assertNumQueries(0):
+            response = self.client.get(link)
+        self.assertRedirects(
+            response, f'http://testserver/recipes/{self.recipe.id}/',
+            fetch_redirect_response=False)
+
+    def test_legacy_slug_served_from_cache(self):
+        ShortLink.objects.create(
+            slug='a1b2c3d', original_url='http://testserver/recipes/1/')
+        self.client.get('/s/a1b2c3d/')
+        local_links.clear()
+        with self.assertNumQueries(0):
+            response = self.client.get('/s/a1b2c3d/')
+        self.assertRedirects(response, 'http://testserver/recipes/1/',
+                             fetch_redirect_response=False)
+
+    def test_unknown_slug_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/s/unknown/').status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/s/unknown/').status_code, 404)
+
+
+class CountersTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Иван', last_name='Иванов', password='password'
+        )
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+
+    def create_recipe(self):
+        return Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            image='recipe/images/test.png', cooking_time=10
+        )
+
+    def assertCounters(self, recipe, favorites, recipes, subscribers):
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, favorites)
+        self.assertEqual(self.author.recipes_count, recipes)
+        self.assertEqual(self.author.subscribers_count, subscribers)
+        self.assertEqual(self.user.subscriptions_count, subscribers)
+
+    def test_counters_follow_api_actions(self):
+        recipe = self.create_recipe()
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('recipe-favorite', args=(recipe.id,)))
+        self.client.post(reverse('user-subscribe', args=(self.author.id,)))
+        self.assertCounters(recipe, favorites=1, recipes=1, subscribers=1)
+        self.client.delete(reverse('recipe-favorite', args=(recipe.id,)))
+        self.client.delete(reverse('user-subscribe', args=(self.author.id,)))
+        self.assertCounters(recipe, favorites=0, recipes=1, subscribers=0)
+        recipe.delete()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def test_reconcile_counters(self):
+        recipe = self.create_recipe()
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        Subscription.objects.create(user=self.user, author=self.author)
+        Recipe.objects.update(favorites_count=10)
+        User.objects.update(recipes_count=10, subscribers_count=10,
+                            subscriptions_count=10)
+        call_command('reconcile_counters', batch_size=1, stdout=StringIO())
+        self.assertCounters(recipe, favorites=1, recipes=1, subscribers=1)
+
+
+class AnonymousResponseCacheTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Описание',
+            image='recipe/images/test.png', cooking_time=10
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_and_not_modified(self):
+        url = reverse('recipe-list')
+        response = self.client.get(url, {'limit': 5, 'author': 1})
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, {'author': 1, 'limit': 5})
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                url, {'limit': 5, 'author': 1},
+                HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalidated_on_recipe_update(self):
+        url = reverse('recipe-detail', args=(self.recipe.id,))
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'Новое название'
+            self.recipe.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Новое название')
+
+    def test_authenticated_not_cached(self):
+        self.client.force_authenticate(self.author)
+        response = self.client.get(reverse('recipe-list'))
+        self.assertNotIn('ETag', response)
+
+    def test_invalidated_only_on_profile_change(self):
+        url = reverse('recipe-list')
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.last_login = timezone.now()
+            self.author.save(update_fields=('last_login',))
+            self.author.set_password('new-password')
+            self.author.save()
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Павел'
+            self.author.save()
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(ALLOWED_HOSTS=['*'])
+    def test_key_includes_scheme_and_host(self):
+        url = reverse('recipe-list')
+        etags = {
+            self.client.get(url, **extra)['ETag']
+            for extra in ({}, {'secure': True},
+                          {'HTTP_HOST': 'mirror.example.com'})
+        }
+        self.assertEqual(len(etags), 3)
+
+    def test_last_modified_is_fallback(self):
+        url = reverse('recipe-list')
+        cache.set('recipes:version', time.time() - 10, None)
+        response = self.client.get(url)
+        since = response['Last-Modified']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=since).status_code,
+            304)
+        # ETag не совпал: дата изменения уже не проверяется
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=since,
+                            HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        # Версия текущей секунды: дата ещё может повториться
+        cache.set('recipes:version', time.time(), None)
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=since).status_code,
+            200)
+
+
+class MediaTestCase(APITestCase):
+    """Тесты, пишущие файлы во временный MEDIA_ROOT."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+
+    def create_recipe(self, color='red'):
+        buffer = BytesIO()
+        Image.new('RGBA', (2000, 1000), color).save(buffer, 'PNG')
+        recipe = Recipe(author=self.author, name='Рецепт', text='Описание',
+                        cooking_time=10)
+        recipe.image.save('photo.png', ContentFile(buffer.getvalue()),
+                          save=False)
+        recipe.save()
+        return recipe
+
+
+class ImageVariantsTest(MediaTestCase):
+
+    def test_build_variants(self):
+        recipe = self.create_recipe()
+        variants = build_variants(recipe.image)
+        self.assertEqual(variants['source'], recipe.image.name)
+        with recipe.image.storage.open(variants['thumbnail']['webp']) as file:
+            image = Image.open(file)
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.size, (160, 80))
+        with recipe.image.storage.open(variants['full']['fallback']) as file:
+            self.assertEqual(Image.open(file).format, 'JPEG')
+
+    def test_serializer_url_map(self):
+        recipe = self.create_recipe()
+        url = reverse('recipe-detail', args=(recipe.id,))
+        variants = self.client.get(url).data['image_variants']
+        # Пока варианты не построены, отдаётся оригинал
+        self.assertIsNone(variants['card']['webp'])
+        self.assertTrue(variants['card']['fallback'].endswith('.png'))
+        Recipe.objects.filter(pk=recipe.pk).update(
+            image_variants=build_variants(recipe.image))
+        cache.clear()
+        variants = self.client.get(url).data['image_variants']
+        self.assertIn('/media/variants/', variants['card']['webp'])
+        self.assertTrue(variants['card']['webp'].endswith('.webp'))
+        self.assertTrue(variants['card']['fallback'].endswith('.jpg'))
+
+    def test_broken_upload_falls_back_to_original(self):
+        buffer = BytesIO()
+        Image.new('RGB', (400, 400), 'red').save(buffer, 'PNG')
+        truncated = buffer.getvalue()[:len(buffer.getvalue()) // 2]
+        for content, pixels in ((truncated, Image.MAX_IMAGE_PIXELS),
+                                (buffer.getvalue(), 100)):
+            with self.subTest(pixels=pixels), mock.patch.object(
+                    Image, 'MAX_IMAGE_PIXELS', pixels):
+                recipe = self.create_recipe()
+                recipe.image.save('photo.png', ContentFile(content))
+                # Фоновый поток закрывает соединение, тест — в транзакции
+                with self.assertLogs('api.images', 'ERROR'), mock.patch(
+                        'api.images.close_old_connections'):
+                    generate_variants(Recipe, recipe.pk, 'image')
+                recipe.refresh_from_db()
+                self.assertEqual(recipe.image_variants, {})
+                cache.clear()
+                variants = self.client.get(reverse(
+                    'recipe-detail', args=(recipe.id,))).data['image_variants']
+                self.assertTrue(
+                    variants['card']['fallback'].endswith('.png'))
+
+
+class ContentAddressedStorageTest(MediaTestCase):
+
+    def test_same_content_stored_once(self):
+        first, second = self.create_recipe(), self.create_recipe()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.startswith('recipe/images/'))
+        self.assertNotEqual(self.create_recipe('blue').image.name,
+                            first.image.name)
+
+    def test_garbage_collection(self):
+        kept = self.create_recipe()
+        orphan = self.create_recipe('blue')
+        orphan_name = orphan.image.name
+        orphan.delete()
+        call_command('collect_media_garbage', min_age=0, stdout=StringIO())
+        storage = kept.image.storage
+        self.assertTrue(storage.exists(kept.image.name))
+        self.assertFalse(storage.exists(orphan_name))
+
+    def test_reused_file_is_refreshed(self):
+        recipe = self.create_recipe()
+        name = recipe.image.name
+        with default_storage.open(name) as file:
+            content = ContentFile(file.read(), 'photo.png')
+        recipe.delete()
+        os.utime(default_storage.path(name), (0, 0))
+        # Файл без ссылок снова сохранён: транзакция ещё не завершена
+        self.assertEqual(default_storage.save('recipe/images/photo.png',
+                                              content), name)
+        call_command('collect_media_garbage', min_age=60, stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+    def test_concurrent_save_of_same_content(self):
+        name = default_storage.save('recipe/images/photo.png',
+                                    ContentFile(b'data'))
+        # Второй запрос не застал файл при проверке и пишет его сам
+        self.assertEqual(default_storage.get_available_name(name), name)
+        self.assertEqual(default_storage._save(name, ContentFile(b'data')),
+                         name)
+        self.assertEqual(
+            os.listdir(os.path.dirname(default_storage.path(name))),
+            [os.path.basename(name)])
+
+    def test_avatar_delete_keeps_shared_file(self):
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10), 'red').save(buffer, 'PNG')
+        avatar = ('data:image/png;base64,'
+                  + base64.b64encode(buffer.getvalue()).decode())
+        users = [self.author, User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Имя', last_name='Фамилия', password='password')]
+        url = reverse('user-avatar')
+        for user in users:
+            self.client.force_authenticate(user)
+            self.client.put(url, {'avatar': avatar}, format='json')
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, 204)
+        users[0].refresh_from_db()
+        self.assertTrue(users[0].avatar)
+        self.assertTrue(default_storage.exists(users[0].avatar.name))
+
+
+class RecipeWriteQueriesTest(APITestCase):
+    INGREDIENTS_COUNT = 40
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(cls.INGREDIENTS_COUNT + 1)
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Описание',
+            image='recipe/images/test.png', cooking_time=10
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=cls.recipe, ingredient=ingredient,
+                             amount=10)
+            for ingredient in cls.ingredients[:cls.INGREDIENTS_COUNT]
+        )
+
+    def patch(self, ingredients):
+        self.client.force_authenticate(self.author)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(
+                reverse('recipe-detail', args=(self.recipe.id,)),
+                {'ingredients': ingredients}, format='json')
+        statements = [
+            query['sql'] for query in context.captured_queries
+            if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))
+        ]
+        return response, statements
+
+    def test_update_applies_diff(self):
+        ingredients = [{'id': ingredient.id, 'amount': 10}
+                       for ingredient in self.ingredients[1:]]
+        ingredients[0]['amount'] = 20
+        response, statements = self.patch(ingredients)
+        self.assertEqual(response.status_code, 200)
+        # рецепт, состав, проверка id, UPDATE рецепта, удаление (SELECT и
+        # DELETE), изменение, добавление, состав и множества для ответа
+        self.assertLessEqual(len(statements), 12)
+        amounts = dict(self.recipe.recipe_ingredients.values_list(
+            'ingredient_id', 'amount'))
+        self.assertEqual(set(amounts), {item['id'] for item in ingredients})
+        self.assertEqual(amounts[ingredients[0]['id']], 20)
+
+    def test_unknown_ingredient(self):
+        response, _ = self.patch([{'id': 100500, 'amount': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('100500', str(response.data['ingredients']))
+
+
+class LoadIngredientsTest(APITestCase):
+
+    def load(self, items, **options):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.json', encoding='utf-8') as file:
+            json.dump(items, file, ensure_ascii=False)
+            file.flush()
+            out = StringIO()
+            call_command('load_ingredients', file.name, batch_size=2,
+                         stdout=out, **options)
+        return out.getvalue()
+
+    def test_repeated_load_is_idempotent(self):
+        items = [{'name': f'продукт {i}', 'measurement_unit': 'г'}
+                 for i in range(5)]
+        self.assertIn('добавлено 5, обновлено 0', self.load(items))
+        self.assertIn('добавлено 0, обновлено 0, без изменений 5',
+                      self.load(items))
+        self.assertEqual(Ingredient.objects.count(), 5)
+
+    def test_update_and_prune(self):
+        used, stale, renamed = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('используемый', 'лишний', 'соль')
+        )
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Описание',
+            image='recipe/images/test.png', cooking_time=10
+        )
+        RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=used, amount=1)
+        output = self.load([{'name': ' Соль ', 'measurement_unit': 'г'}],
+                           prune=True)
+        self.assertIn('обновлено 1', output)
+        self.assertIn('удалено 1', output)
+        renamed.refresh_from_db()
+        self.assertEqual(renamed.name, 'Соль')
+        self.assertTrue(Ingredient.objects.filter(pk=used.pk).exists())
+        self.assertFalse(Ingredient.objects.filter(pk=stale.pk).exists())
+
+
+class LoadRecipesTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+
+    def setUp(self):
+        # Процессы пула получают MEDIA_ROOT от команды
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        buffer = BytesIO()
+        Image.new('RGB', (4, 4), 'red').save(buffer, 'PNG')
+        self.image = ('data:image/png;base64,'
+                      + base64.b64encode(buffer.getvalue()).decode())
+
+    def record(self, name, **fields):
+        return {'author': 'author', 'name': name, 'text': 'Описание',
+                'cooking_time': 10, 'image': self.image,
+                'ingredients': [{'name': 'соль', 'amount': 5}], **fields}
+
+    def load(self, records, **options):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.jsonl', encoding='utf-8') as file:
+            file.writelines(json.dumps(record, ensure_ascii=False) + '\n'
+                            for record in records)
+            file.flush()
+            out, err = StringIO(), StringIO()
+            call_command('load_recipes', file.name, workers=1,
+                         checkpoint='test', stdout=out, stderr=err,
+                         **options)
+        return err.getvalue()
+
+    def test_bad_records_are_skipped(self):
+        errors = self.load([
+            self.record('Суп'),
+            self.record('Без изображения', image=None),
+            self.record('Число вместо изображения', image=5),
+            self.record('Без автора', author='nobody'),
+            'не объект',
+            self.record('Каша'),
+            self.record(''),
+            self.record(['Список']),
+            self.record('Д' * 257),
+            self.record('Без описания', text=' '),
+        ])
+        self.assertEqual(
+            set(Recipe.objects.values_list('name', flat=True)),
+            {'Суп', 'Каша'})
+        for line in (2, 3, 4, 5, 7, 8, 9, 10):
+            self.assertIn(f'Строка {line}:', errors)
+        # Файлы пишутся во временный MEDIA_ROOT теста
+        for name in Recipe.objects.values_list('image', flat=True):
+            self.assertTrue(
+                os.path.exists(os.path.join(self.media_root, name)))
+
+    def test_resume_after_failure_does_not_duplicate(self):
+        records = [self.record(f'Рецепт {i}') for i in range(3)]
+        with mock.patch('api.management.commands.load_recipes.fan_out',
+                        side_effect=[None, RuntimeError]):
+            with self.assertRaises(RuntimeError):
+                self.load(records, batch_size=1)
+        self.assertEqual(Recipe.objects.count(), 1)
+        self.assertEqual(RecipeImport.objects.get(source='test').last_line,
+                         1)
+        self.load(records, batch_size=1)
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('name', flat=True)),
+            [record['name'] for record in records])
+        # Повторный запуск начинает с конца файла
+        self.load(records)
+        self.assertEqual(Recipe.objects.count(), 3)
+
+
+class RecipeSearchTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        for name, text in (('Борщ украинский', 'Свёкла и капуста'),
+                           ('Салат из свёклы', 'Быстрый салат'),
+                           ('Котлеты', 'Подаются с борщом')):
+            Recipe.objects.create(
+                author=author, name=name, text=text,
+                image='recipe/images/test.png', cooking_time=10
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_search_ranks_name_matches_first(self):
+        response = self.client.get(reverse('recipe-list'),
+                                   {'search': 'борщ'})
+        self.assertEqual(
+            [recipe['name'] for recipe in response.data['results']],
+            ['Борщ украинский', 'Котлеты'])
+        response = self.client.get(reverse('recipe-list'),
+                                   {'search': 'салат быстрый'})
+        self.assertEqual(response.data['count'], 1)
+
+    @override_settings(RECIPE_SEARCH_MAX_RESULTS=1)
+    def test_name_matches_survive_candidate_limit(self):
+        author = User.objects.get()
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Квас {i}', text='Для окрошки',
+                   image='recipe/images/test.png', cooking_time=10)
+            for i in range(5)
+        )
+        Recipe.objects.create(
+            author=author, name='Окрошка на квасе', text='Холодный суп',
+            image='recipe/images/test.png', cooking_time=10)
+        response = self.client.get(reverse('recipe-list'),
+                                   {'search': 'окрошка'})
+        self.assertEqual(response.data['results'][0]['name'],
+                         'Окрошка на квасе')
+        response = self.client.get(reverse('recipe-suggest'),
+                                   {'search': 'окрош'})
+        self.assertEqual(response.data[0]['name'], 'Окрошка на квасе')
+
+    def test_cursor_with_search_rejected(self):
+        response = self.client.get(reverse('recipe-list'),
+                                   {'search': 'борщ', 'cursor': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.data)
+        # Явная сортировка задаёт ключ курсора, ранг не нужен
+        response = self.client.get(
+            reverse('recipe-list'),
+            {'search': 'борщ', 'cursor': '', 'ordering': 'popular'})
+        self.assertEqual(len(response.data['results']), 2)
+
+    async def test_cursor_with_search_rejected_async(self):
+        response = await self.async_client.get(
+            reverse('recipe-list'), {'search': 'борщ', 'cursor': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.json())
+
+    def test_suggestions_by_prefix(self):
+        response = self.client.get(reverse('recipe-suggest'),
+                                   {'search': 'сал'})
+        self.assertEqual([item['name'] for item in response.data],
+                         ['Салат из свёклы'])
+        response = self.client.get(reverse('recipe-suggest'),
+                                   {'search': 'с'})
+        self.assertEqual(response.data, [])
+
+
+class IngredientFilterTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        cls.salt, cls.egg, cls.milk = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('соль', 'яйцо', 'молоко')
+        )
+        compositions = {
+            'Омлет': (cls.salt, cls.egg, cls.milk),
+            'Яичница': (cls.salt, cls.egg),
+            'Каша': (cls.salt, cls.milk),
+        }
+        for name, ingredients in compositions.items():
+            recipe = Recipe.objects.create(
+                author=author, name=name, text='Описание',
+                image='recipe/images/test.png', cooking_time=10
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in ingredients
+            )
+
+    def names(self, **params):
+        response = self.client.get(reverse('recipe-list'), params)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def test_required_and_excluded_ingredients(self):
+        self.assertEqual(
+            self.names(ingredients=f'{self.egg.id},{self.salt.id}'),
+            ['Омлет', 'Яичница'])
+        self.assertEqual(
+            self.names(ingredients=self.salt.id,
+                       exclude_ingredients=self.milk.id),
+            ['Яичница'])
+        with CaptureQueriesContext(connection) as context:
+            self.names(ingredients=f'{self.egg.id},{self.milk.id}',
+                       exclude_ingredients=self.salt.id)
+        # Оба фильтра — подзапросы к индексу, без соединений
+        self.assertNotIn('JOIN "api_recipeingredient"',
+                         context.captured_queries[0]['sql'])
+
+
+class PantryTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('соль', 'яйцо', 'молоко', 'мука')
+        )
+        cls.salt, cls.egg, cls.milk, cls.flour = ingredients
+        compositions = {
+            'Блины': (cls.salt, cls.egg, cls.milk, cls.flour),
+            'Яичница': (cls.salt, cls.egg),
+            'Каша': (cls.salt, cls.milk),
+        }
+        cls.recipes = {}
+        for name, ingredients in compositions.items():
+            cls.recipes[name] = recipe = Recipe.objects.create(
+                author=cls.author, name=name, text='Описание',
+                image='recipe/images/test.png', cooking_time=10
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in ingredients
+            )
+
+    def setUp(self):
+        pantry_index.invalidate()
+
+    def match(self, *ingredients):
+        response = self.client.get(reverse('recipe-pantry'), {
+            'ingredients': ','.join(str(item.id) for item in ingredients)})
+        self.assertEqual(response.status_code, 200)
+        return [(recipe['name'], recipe['coverage'], recipe['missing'])
+                for recipe in response.data['results']]
+
+    def test_ranked_by_coverage_and_missing(self):
+        self.assertEqual(self.match(self.egg, self.salt), [
+            ('Яичница', 1.0, 0), ('Каша', 0.5, 1), ('Блины', 0.5, 2)])
+        self.assertEqual(self.match(self.flour), [('Блины', 0.25, 3)])
+        response = self.client.get(reverse('recipe-pantry'),
+                                   {'ingredients': 'соль'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_incremental_refresh(self):
+        self.match(self.salt)
+        porridge = self.recipes['Каша']
+        with self.captureOnCommitCallbacks(execute=True):
+            porridge.recipe_ingredients.filter(ingredient=self.salt).delete()
+            porridge.save()
+            Recipe.objects.filter(pk=self.recipes['Блины'].pk).delete()
+        self.assertEqual(self.match(self.salt, self.milk),
+                         [('Каша', 1.0, 0), ('Яичница', 0.5, 1)])
+
+
+# Таблицы, которые в рабочей базе велики: полный просмотр любой из них
+# в горячем запросе — регрессия
+LARGE_TABLES = (
+    'api_user', 'api_recipe', 'api_recipeingredient', 'api_favorite',
+    'api_shoppingcart', 'api_subscription', 'api_feedentry',
+)
+
+
+def full_scans(plan, vendor, limited=False):
+    """Таблицы, которые план читает целиком, а не по индексу.
+
+    SQLite пишет «SCAN t» и для обхода всего индекса в нужном порядке:
+    это допустимо, только если запрос остановится по LIMIT.
+    """
+    if vendor == 'postgresql':
+        scanned = re.findall(r'Seq Scan on (\w+)', plan)
+    else:
+        scanned = re.findall(
+            r'SCAN (\w+)(?! USING)' if limited else r'SCAN (\w+)', plan)
+    return sorted(set(scanned) & set(LARGE_TABLES))
+
+
+class QueryPlanTest(APITestCase):
+    """EXPLAIN каждого SELECT горячих запросов на реалистичных данных."""
+
+    USERS = 200
+    RECIPES = 2000
+    INGREDIENTS = 500
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create(
+            User(email=f'user{i}@example.com', username=f'user{i}',
+                 first_name='Имя', last_name='Фамилия')
+            for i in range(cls.USERS)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(cls.INGREDIENTS)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=users[i % cls.USERS], name=f'Рецепт {i}',
+                   text='Описание', image='recipe/images/test.png',
+                   cooking_time=10)
+            for i in range(cls.RECIPES)
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient=ingredients[(i * 7 + j * 31) % cls.INGREDIENTS],
+                amount=10
+            )
+            for i, recipe in enumerate(recipes) for j in range(8)
+        )
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                model(user=user, recipe=recipes[(i * 13 + j) % cls.RECIPES])
+                for i, user in enumerate(users) for j in range(10)
+            )
+        Subscription.objects.bulk_create(
+            Subscription(user=user, author=users[(i + j + 1) % cls.USERS])
+            for i, user in enumerate(users) for j in range(10)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = users[0]
+        cls.recipe = recipes[0]
+        cls.ingredients = ingredients
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor != 'postgresql':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+            # На тестовом объёме PostgreSQL дешевле прочесть таблицу
+            # целиком, чем идти по индексу. Без seq scan планировщик
+            # выбирает индекс, если он подходит, и читает таблицу
+            # целиком, только если подходящего индекса нет
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                cursor.execute('EXPLAIN ' + sql)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+            finally:
+                cursor.execute('RESET enable_seqscan')
+
+    def assertNoFullScans(self, url, params=None, user=None):
+        cache.clear()
+        if user:
+            self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+            # Потоковые ответы выполняют запросы при чтении
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            # Общее число строк для пагинации без WHERE
+            # считается по всей таблице намеренно
+            if sql.startswith('SELECT COUNT(*)') and ' WHERE ' not in sql:
+                continue
+            plan = self.explain(sql)
+            with self.subTest(url=url, params=params, sql=sql):
+                self.assertEqual(
+                    full_scans(plan, connection.vendor, ' LIMIT ' in sql),
+                    [], f'\n{sql}\n{plan}')
+
+    def test_full_scan_detection(self):
+        self.assertEqual(full_scans('SCAN api_recipe', 'sqlite'),
+                         ['api_recipe'])
+        plan = 'SCAN api_recipe USING INDEX recipe_name_id_idx'
+        self.assertEqual(full_scans(plan, 'sqlite', limited=True), [])
+        self.assertEqual(full_scans(plan, 'sqlite'), ['api_recipe'])
+        self.assertEqual(full_scans(
+            'Seq Scan on api_favorite  (cost=0.00..35.50 rows=10)\n'
+            'Seq Scan on api_ingredient  (cost=0.00..1.50 rows=5)',
+            'postgresql'), ['api_favorite'])
+
+    def test_recipe_list(self):
+        url = reverse('recipe-list')
+        self.assertNoFullScans(url)
+        self.assertNoFullScans(url, {'cursor': ''})
+        self.assertNoFullScans(url, {'author': self.user.id})
+        self.assertNoFullScans(url, {'ingredients': self.ingredients[0].id})
+        self.assertNoFullScans(url, {'is_favorited': 1}, user=self.user)
+        self.assertNoFullScans(url, {'is_in_shopping_cart': 1},
+                               user=self.user)
+
+    def test_recipe_detail(self):
+        self.assertNoFullScans(
+            reverse('recipe-detail', args=(self.recipe.id,)),
+            user=self.user)
+
+    def test_subscriptions(self):
+        self.assertNoFullScans(reverse('user-subscriptions'),
+                               {'recipes_limit': 3}, user=self.user)
+
+    def test_shopping_cart_download(self):
+        self.assertNoFullScans(reverse('recipe-download-shopping-cart'),
+                               {'format': 'csv'}, user=self.user)
+
+    def test_feed(self):
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertNoFullScans(reverse('recipe-feed'), {'limit': 5},
+                               user=self.user)
+
+    def test_user_profile(self):
+        self.assertNoFullScans(reverse('user-detail', args=(self.user.id,)),
+                               user=self.user)
+
+
+class FeedTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author, cls.star, cls.stranger = (
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name='Имя', last_name='Фамилия', password='password'
+            )
+            for name in ('user', 'author', 'star', 'stranger')
+        )
+        cls.old = cls.create_recipe(cls.author, 'До подписки')
+
+    @classmethod
+    def create_recipe(cls, author, name):
+        return Recipe.objects.create(
+            author=author, name=name, text='Описание',
+            image='recipe/images/test.png', cooking_time=10
+        )
+
+    def subscribe(self, author):
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('user-subscribe', args=(author.id,)))
+
+    def publish(self, author, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.create_recipe(author, name)
+
+    def feed(self, **params):
+        response = self.client.get(reverse('recipe-feed'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    @override_settings(FEED_FANOUT_MAX_SUBSCRIBERS=0)
+    def test_popular_authors_merged_at_read_time(self):
+        self.subscribe(self.star)
+        with self.settings(FEED_FANOUT_MAX_SUBSCRIBERS=1000):
+            self.subscribe(self.author)
+        self.publish(self.stranger, 'Чужой')
+        self.publish(self.star, 'Звезда 1')
+        self.publish(self.author, 'Автор')
+        self.publish(self.star, 'Звезда 2')
+        # При пороге 0 популярны оба автора: новые рецепты в ленты
+        # не раскладываются, записанное при подписке не дублируется
+        self.assertEqual(
+            list(FeedEntry.objects.values_list('recipe__name', flat=True)),
+            ['До подписки'])
+        names = []
+        data = self.feed(limit=2)
+        while True:
+            names += [recipe['name'] for recipe in data['results']]
+            if not data['next']:
+                break
+            data = self.client.get(data['next']).data
+        self.assertEqual(
+            names, ['Звезда 2', 'Автор', 'Звезда 1', 'До подписки'])
+
+    def test_fan_out_and_unsubscribe(self):
+        self.subscribe(self.author)
+        self.publish(self.author, 'Новый')
+        self.assertEqual(
+            [recipe['name'] for recipe in self.feed()['results']],
+            ['Новый', 'До подписки'])
+        self.client.delete(reverse('user-subscribe', args=(self.author.id,)))
+        self.assertEqual(self.feed()['results'], [])
+        response = self.client.get(reverse('recipe-feed'), {'cursor': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+
+class SimilarRecipesTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{i}@example.com', username=f'user{i}',
+                first_name='Имя', last_name='Фамилия', password='password'
+            )
+            for i in range(4)
+        ]
+        cls.a, cls.b, cls.c, cls.d = (
+            Recipe.objects.create(
+                author=cls.users[0], name=name, text='Описание',
+                image='recipe/images/test.png', cooking_time=10
+            )
+            for name in 'ABCD'
+        )
+        for user, recipes in zip(cls.users, ((cls.a, cls.b), (cls.a, cls.b),
+                                             (cls.a, cls.c), (cls.d,))):
+            for recipe in recipes:
+                Favorite.objects.create(user=user, recipe=recipe)
+        ShoppingCart.objects.create(user=cls.users[0], recipe=cls.d)
+
+    def similar(self, recipe):
+        response = self.client.get(
+            reverse('recipe-similar', args=(recipe.id,)))
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.data]
+
+    def build(self, **options):
+        call_command('build_similar_recipes', stdout=StringIO(), **options)
+
+    def test_full_and_incremental_build(self):
+        self.build()
+        self.assertEqual(self.similar(self.a), ['B', 'C', 'D'])
+        self.assertEqual(self.similar(self.c), ['A'])
+        Favorite.objects.create(user=self.users[3], recipe=self.a)
+        self.build()
+        last = RecipeSimilarityBuild.objects.latest('pk')
+        self.assertFalse(last.full)
+        # Пересчитаны только рецепты пользователя с новой связью: A и D
+        self.assertEqual(last.recipes, 2)
+        self.assertEqual(self.similar(self.d), ['A', 'B'])
+        self.assertEqual(self.similar(self.a)[0], 'B')
+
+
+class RecipeScoresTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [
+            User.objects.create_user(
+                email=f'user{i}@example.com', username=f'user{i}',
+                first_name='Имя', last_name='Фамилия', password='password'
+            )
+            for i in range(3)
+        ]
+        old, fresh, unused = (
+            Recipe.objects.create(
+                author=users[0], name=name, text='Описание',
+                image='recipe/images/test.png', cooking_time=10
+            )
+            for name in ('Старый', 'Свежий', 'Без отметок')
+        )
+        # Три давние отметки против одной сегодняшней
+        for user in users:
+            Favorite.objects.create(user=user, recipe=old)
+        Favorite.objects.filter(recipe=old).update(
+            created=timezone.now() - timedelta(days=10))
+        ShoppingCart.objects.create(user=users[0], recipe=fresh)
+        Recipe.objects.filter(pk=unused.pk).update(
+            popularity_score=5, trending_score=5)
+
+    def names(self, ordering, **params):
+        url = reverse('recipe-list')
+        params = {'ordering': ordering, **params}
+        names = []
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            names.extend(item['name'] for item in response.data['results'])
+            url, params = response.data.get('next'), None
+        return names
+
+    def test_decay(self):
+        _, scores = compute_scores(
+            np.array([1, 1, 2]), np.array([1.0, 1.0, 0.5]),
+            np.array([0.0, 30.0, 1.0]))
+        self.assertEqual(scores['popularity_score'].tolist(),
+                         [1.5, 0.5 * 2 ** (-1 / 30)])
+        self.assertEqual(scores['trending_score'].tolist(),
+                         [1 + 2 ** -30, 0.25])
+
+    def test_orderings(self):
+        call_command('update_recipe_scores', stdout=StringIO())
+        self.assertEqual(self.names('popular'),
+                         ['Старый', 'Свежий', 'Без отметок'])
+        self.assertEqual(self.names('trending'),
+                         ['Свежий', 'Старый', 'Без отметок'])
+        # Курсор продолжает ту же сортировку
+        self.assertEqual(self.names('trending', cursor='', limit=1),
+                         ['Свежий', 'Старый', 'Без отметок'])
+
+    def test_invalid_ordering(self):
+        response = self.client.get(
+            reverse('recipe-list'), {'ordering': 'random'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncReadViewsTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, author = (
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name='Имя', last_name='Фамилия', password='password'
+            )
+            for name in ('user', 'author')
+        )
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        for name in ('Борщ', 'Щи', 'Уха'):
+            recipe = Recipe.objects.create(
+                author=author, name=name, text='Описание',
+                image='recipe/images/test.png', cooking_time=10
+            )
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=salt, amount=5)
+        cls.recipe = recipe
+        Favorite.objects.create(user=cls.user, recipe=recipe)
+        Subscription.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        cache.clear()
+
+    def sync_response(self, viewset, action, url, **kwargs):
+        with override_settings(ASYNC_READ_VIEWS=False):
+            view = viewset.as_view({'get': action})
+        request = APIRequestFactory().get(url)
+        force_authenticate(request, self.user)
+        return view(request, **kwargs).render()
+
+    def test_same_responses_as_sync_views(self):
+        self.client.force_authenticate(self.user)
+        detail = reverse('recipe-detail', args=(self.recipe.id,))
+        for viewset, action, url, kwargs in (
+            (RecipeViewSet, 'list', reverse('recipe-list'), {}),
+            (RecipeViewSet, 'list',
+             reverse('recipe-list') + '?is_favorited=1', {}),
+            (RecipeViewSet, 'list',
+             reverse('recipe-list') + '?cursor=&limit=2', {}),
+            (RecipeViewSet, 'retrieve', detail,
+             {'pk': str(self.recipe.id)}),
+            (IngredientViewSet, 'list',
+             reverse('ingredient-list') + '?name=сол', {}),
+            (UserViewSet, 'subscriptions',
+             reverse('user-subscriptions') + '?recipes_limit=2', {}),
+        ):
+            with self.subTest(url=url):
+                self.assertTrue(asyncio.iscoroutinefunction(
+                    resolve(url.split('?')[0]).func))
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), json.loads(
+                    self.sync_response(viewset, action, url, **kwargs)
+                    .content))
+
+    def test_missing_recipe(self):
+        for pk in (0, 'abc'):
+            response = self.client.get(f'/api/recipes/{pk}/')
+            self.assertEqual(response.status_code, 404)
+
+    def test_writes_stay_sync(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.patch(
+            reverse('recipe-detail', args=(self.recipe.id,)),
+            {'name': 'Новое'})
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+class ReplicaRoutingTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.status = 201
+        self.middleware = replica_middleware(self.view)
+
+    def view(self, request):
+        # Отвечает алиасами, которые выбрал бы роутер
+        return HttpResponse(
+            f'{router.db_for_read(Recipe)} {router.db_for_read(Token)} '
+            f'{router.db_for_write(Recipe)}',
+            status=self.status if request.method == 'POST' else 200)
+
+    def request(self, method, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        request = getattr(self.factory, method)('/api/recipes/', **headers)
+        return self.middleware(request).content.decode().split()
+
+    def test_safe_requests_read_from_replica(self):
+        read, token_read, write = self.request('get', 'first')
+        self.assertIn(read, ('replica_1', 'replica_2'))
+        self.assertEqual((token_read, write), ('default', 'default'))
+        self.assertEqual(self.request('post', 'first')[0], 'default')
+        # Вне запроса чтение идёт с основной БД
+        self.assertEqual(router.db_for_read(Recipe), 'default')
+
+    def test_read_your_writes(self):
+        self.request('post', 'first')
+        self.assertEqual(self.request('get', 'first')[0], 'default')
+        self.assertNotEqual(self.request('get', 'second')[0], 'default')
+        self.assertNotEqual(self.request('get')[0], 'default')
+        cache.clear()
+        self.assertNotEqual(self.request('get', 'first')[0], 'default')
+
+    def test_failed_write_does_not_pin(self):
+        self.status = 400
+        self.request('post', 'first')
+        self.assertNotEqual(self.request('get', 'first')[0], 'default')
+
+    def test_membership_sets_read_from_primary(self):
+        token = current_replica.set('replica_1')
+        self.addCleanup(current_replica.reset, token)
+        self.assertEqual(router.db_for_read(Favorite), 'replica_1')
+        for model in (Favorite, ShoppingCart, Subscription):
+            self.assertEqual(member_ids(model, 1).db, 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        self.assertEqual(self.request('get', 'first')[0], 'default')
+
+
+class MetricsTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Иван', last_name='Иванов', password='password'
+        )
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        for name in ('Борщ', 'Щи'):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=name, text='Описание',
+                image='recipe/images/test.png', cooking_time=10
+            )
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=salt, amount=5)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def histogram(self, name, route):
+        """Число замеров и сумма гистограммы маршрута."""
+        _, histograms = metrics.collect()
+        data = histograms.get((name, route), [0, 0])
+        return sum(data[:-1]), data[-1]
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('recipe-list'))
+        timing = dict(
+            re.match(r'\s*(\w+);dur=([\d.]+)', part).groups()
+            for part in response['Server-Timing'].split(','))
+        self.assertEqual(set(timing), {'db', 'serialize', 'total'})
+        self.assertIn(f'desc="{len(queries)} SQL"',
+                      response['Server-Timing'])
+        self.assertGreater(float(timing['serialize']), 0)
+        self.assertGreaterEqual(
+            float(timing['total']), float(timing['db']))
+
+    def test_route_histograms(self):
+        count, _ = self.histogram(
+            'http_request_db_queries', 'recipe-list')
+        sizes, _ = self.histogram('http_response_size_bytes', 'recipe-list')
+        for _ in range(2):
+            response = self.client.get(reverse('recipe-list'))
+        self.assertEqual(self.histogram(
+            'http_request_db_queries', 'recipe-list')[0], count + 2)
+        self.assertEqual(
+            self.histogram('http_response_size_bytes', 'recipe-list'),
+            (sizes + 2, self.histogram(
+                'http_response_size_bytes', 'recipe-list')[1]))
+        self.assertGreaterEqual(self.histogram(
+            'http_response_size_bytes', 'recipe-list')[1],
+            2 * len(response.content))
+
+    def test_streaming_response(self):
+        route = 'recipe-download-shopping-cart'
+        count, queries = self.histogram('http_request_db_queries', route)
+        _, size = self.histogram('http_response_size_bytes', route)
+        response = self.client.get(reverse(route))
+        content = b''.join(response.streaming_content)
+        # Учтён после отдачи, вместе с запросами из генератора
+        self.assertEqual(
+            self.histogram('http_request_db_queries', route),
+            (count + 1, queries + 2))
+        self.assertEqual(
+            self.histogram('http_response_size_bytes', route)[1],
+            size + len(content))
+
+    def test_export(self):
+        self.client.get(reverse('recipe-list'))
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertRegex(
+            text, r'http_requests_total\{route="recipe-list",method="GET",'
+                  r'status="200"\} \d+')
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertRegex(
+            text, r'http_request_db_queries_bucket\{route="recipe-list",'
+                  r'le="\+Inf"\} \d+')
+        self.assertNotIn('route="metrics"', text)
+
+
+class MigrationsTest(TransactionTestCase):
+    """Миграции данных на записях из предыдущих версий схемы."""
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('api', target)])
+        executor.loader.build_graph()
+        return executor.loader.project_state(('api', target)).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('api'))
+
+    def test_scores_ignore_events_before_0013(self):
+        apps = self.migrate('0010_hot_query_indexes')
+        author = apps.get_model('api', 'User').objects.create(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Авторов')
+        recipe = apps.get_model('api', 'Recipe').objects.create(
+            author=author, name='Блины', text='Описание',
+            image='recipe/images/test.png', cooking_time=10)
+        apps.get_model('api', 'Favorite').objects.create(
+            user=author, recipe=recipe)
+        apps.get_model('api', 'ShoppingCart').objects.create(
+            user=author, recipe=recipe)
+        # 0011 ставит рецепту время применения миграции, то есть «сейчас»
+        apps = self.migrate('0013_recipe_scores')
+        for name in ('Favorite', 'ShoppingCart'):
+            self.assertLess(
+                apps.get_model('api', name).objects.get().created,
+                timezone.now() - timedelta(days=365))
+        _, scores = compute_scores(*load_events())
+        self.assertLess(scores['trending_score'][0], 1e-6)
+        self.assertLess(scores['popularity_score'][0], 1e-6)
+
+    def test_duplicate_ingredients_amounts_are_merged(self):
+        apps = self.migrate('0005_image_variants')
+        Ingredient = apps.get_model('api', 'Ingredient')
+        RecipeIngredient = apps.get_model('api', 'RecipeIngredient')
+        author = apps.get_model('api', 'User').objects.create(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Авторов')
+        recipe = apps.get_model('api', 'Recipe').objects.create(
+            author=author, name='Блины', text='Описание',
+            image='recipe/images/test.png', cooking_time=10)
+        salt, duplicate, pepper = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'соль', 'перец'))
+        for ingredient, amount in ((salt, 5), (duplicate, 3), (pepper, 1)):
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=amount)
+        apps = self.migrate('0006_merge_duplicate_ingredients')
+        self.assertEqual(
+            sorted(apps.get_model('api', 'RecipeIngredient').objects
+                   .values_list('ingredient_id', 'amount')),
+            [(salt.pk, 8), (pepper.pk, 1)])
@@ -1,60 +1,146 @@
-from datetime import datetime
+from functools import partial
+
 from rest_framework import viewsets, status, permissions
 from rest_framework.response import Response
-from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import SAFE_METHODS
 from rest_framework.exceptions import ValidationError
 from rest_framework.decorators import action
-from django.db.models import Sum
-from django.http import FileResponse
+from rest_framework.pagination import LimitOffsetPagination
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import (
+    F, Prefetch, Value, Window
+)
+from django.db.models.functions import RowNumber
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
+from django.utils.http import parse_etags
 from django.views import View
 from djoser.views import UserViewSet as DjoserUserViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .filters import RecipeFilter
+from .async_views import AsyncReadMixin
+from .filters import RECIPE_ORDERINGS, RecipeFilter
+from .membership import get_membership
+from .metrics import CONTENT_TYPE, metrics
 from .models import (
-    Recipe, Ingredient, Favorite, Subscription, User, ShoppingCart, ShortLink
+    Recipe, Ingredient, Favorite, Subscription, User, ShoppingCart,
+    RecipeIngredient, RecipeSimilarity
 )
 from .serializers import (
     UserWithSubscriptionsSerializer,
     UserDetailSerializer, AvatarUpdateSerializer,
     RecipeReadSerializer, RecipeWriteSerializer, ShortRecipeSerializer,
-    IngredientSerializer
+    IngredientSerializer, PantryRecipeSerializer
 )
+from .feed import feed_page
+from .pagination import FeedPagination, LimitOffsetOrCursorPagination
+from .pantry import pantry_index
 from .permissions import OwnerOrReadOnly
+from .renderers import CSVRenderer, PDFRenderer, PlainTextRenderer
+from .response_cache import AnonymousResponseCacheMixin
+from .search import ingredient_index, search_words, suggest_recipes
+from .shopping_list import render
+from .shortlinks import (
+    aresolve_short_link, decode_recipe_slug, encode_recipe_slug,
+    resolve_short_link
+)
 
 
+@transaction.atomic
 def handle_add_or_remove(request, obj, model, lookup_fields,
                          serializer_class, error_messages):
     if request.method == 'POST':
         instance, created = model.objects.get_or_create(**lookup_fields)
         if not created:
             raise ValidationError({'errors': error_messages['already_exists']})
+        get_membership(request).update(model, obj.pk, present=True)
         serializer = serializer_class(obj, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     if request.method == 'DELETE':
         instance = get_object_or_404(model, **lookup_fields)
         instance.delete()
+        get_membership(request).update(model, obj.pk, present=False)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+def recipe_frontend_url(request, pk):
+    # Получаем путь
+    api_path = reverse('recipe-detail', args=[pk])
+    # Удаляем префикс "/api", чтобы получить "/recipes/1/"
+    frontend_path = api_path.replace('/api', '', 1)
+    # Строим абсолютный URL
+    return request.build_absolute_uri(frontend_path)
+
+
 class ShortLinkRedirectView(View):
     def get(self, request, slug):
-        short_link = get_object_or_404(ShortLink, slug=slug)
-        return redirect(short_link.original_url)
+        # Коды рецептов декодируются без обращения к БД
+        recipe_id = decode_recipe_slug(slug)
+        if recipe_id is not None:
+            return redirect(recipe_frontend_url(request, recipe_id))
+        original_url = resolve_short_link(slug)
+        if original_url is None:
+            raise Http404
+        return redirect(original_url)
+
+
+class AsyncShortLinkRedirectView(View):
+    async def get(self, request, slug):
+        recipe_id = decode_recipe_slug(slug)
+        if recipe_id is not None:
+            return redirect(recipe_frontend_url(request, recipe_id))
+        original_url = await aresolve_short_link(slug)
+        if original_url is None:
+            raise Http404
+        return redirect(original_url)
+
 
+class MetricsView(View):
+    def get(self, request):
+        return HttpResponse(metrics.export(), content_type=CONTENT_TYPE)
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
+
+class RecipeViewSet(AnonymousResponseCacheMixin, AsyncReadMixin,
+                    viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
                           OwnerOrReadOnly)
-    pagination_class = LimitOffsetPagination
+    pagination_class = LimitOffsetOrCursorPagination
+    async_actions = {'list': 'alist', 'retrieve': 'aretrieve'}
+    membership_models = (Favorite, ShoppingCart, Subscription)
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
 
+    @property
+    def cursor_ordering(self):
+        # Ключ для ?cursor=: у каждой сортировки свой индекс,
+        # по умолчанию recipe_name_id_idx
+        params = self.request.query_params
+        if params.get('ordering') in RECIPE_ORDERINGS:
+            return RECIPE_ORDERINGS[params['ordering']]
+        # Ранг поиска вычисляется в запросе и не годится в ключ курсора,
+        # а сортировка по названию потеряла бы релевантность
+        if search_words(params.get('search', '')):
+            raise ValidationError({'cursor': (
+                'Курсор нельзя сочетать с ?search= без ?ordering=, '
+                'используйте limit и offset.')})
+        return ('name', 'id')
+
+    def get_queryset(self):
+        # Ингредиенты рецептов страницы загружаем одним запросом;
+        # флаги пользователя берутся из кеша членства (api.membership)
+        # Поисковый вектор нужен только в WHERE, в ответ он не попадает
+        return Recipe.objects.select_related('author').defer(
+            'search_vector'
+        ).prefetch_related(
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
+
     def get_serializer_class(self):
         if self.request.method not in SAFE_METHODS:
             return RecipeWriteSerializer
@@ -92,77 +178,124 @@ class RecipeViewSet(viewsets.ModelViewSet):
             }
         )
 
-    @action(detail=False, methods=['GET'])
+    @action(detail=False, methods=['GET'],
+            permission_classes=(permissions.IsAuthenticated,),
+            renderer_classes=(PlainTextRenderer, CSVRenderer, PDFRenderer))
     def download_shopping_cart(self, request):
-        user = request.user
-        # Получаем рецепты в корзине пользователя
-        recipes = Recipe.objects.filter(in_carts__user=user)
-
-        # Собираем ингредиенты с суммированием по количеству из всех рецептов
-        ingredients = (recipes
-                       .values(
-                           'ingredients__name',
-                           'ingredients__measurement_unit')
-                       .annotate(amount=Sum('recipe_ingredients__amount'))
-                       .order_by('ingredients__name'))
-
-        # Формируем текст для файла
-        date_str = datetime.now().strftime('%d.%m.%Y')
-        text = '\n'.join([
-            f'Список покупок для пользователя: {user.get_full_name()}',
-            f'Дата: {date_str}',
-            '',
-            'Необходимые ингредиенты:',
-            *[
-                (f'{idx}. {item["ingredients__name"].capitalize()} '
-                 f'— {item["amount"]} {item["ingredients__measurement_unit"]}')
-                for idx, item in enumerate(ingredients, start=1)
-            ],
-            '',
-            'Рецепты в корзине:',
-            *[
-                f'- {recipe.name} (автор: {recipe.author.username})'
-                for recipe in recipes
-            ]
-        ])
-
-        return FileResponse(
-            text, as_attachment=True, content_type='text/plain'
+        # Формат выбирается по ?format=txt|csv|pdf, по умолчанию txt
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            render(renderer.format, request.user,
+                   asgi=isinstance(request._request, ASGIRequest)),
+            content_type=(f'{renderer.media_type}; charset={renderer.charset}'
+                          if renderer.charset else renderer.media_type)
         )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"')
+        return response
 
     @action(methods=["get"], detail=True, url_path="get-link")
     def get_link(self, request, pk=None):
         if not Recipe.objects.filter(id=pk).exists():
             raise ValidationError(
                 {'errors': f'Рецепта с id={pk} не существует'})
-        # Получаем путь
-        api_path = reverse('recipe-detail', args=[pk])
-        # Удаляем префикс "/api", чтобы получить "/recipes/1/"
-        frontend_path = api_path.replace('/api', '', 1)
-        # Строим абсолютный URL
-        full_url = request.build_absolute_uri(frontend_path)
-        # Находим или создаем короткую ссылку
-        short_link_obj, created = ShortLink.objects.get_or_create(
-            original_url=full_url
-        )
+        # Код вычисляется из id, в БД ничего не сохраняется
+        slug = encode_recipe_slug(pk)
         return Response(
-            data={"short-link":
-                  request.build_absolute_uri(f"/s/{short_link_obj.slug}/")}
+            data={"short-link": request.build_absolute_uri(f"/s/{slug}/")}
         )
 
+    @action(detail=False, methods=['GET'],
+            permission_classes=(permissions.IsAuthenticated,))
+    def feed(self, request):
+        """Новые рецепты авторов из подписок, с курсорной пагинацией."""
+        paginator = FeedPagination()
+        ids = paginator.paginate_feed(
+            partial(feed_page, request.user), request)
+        recipes = self.get_queryset().in_bulk(ids)
+        page = [recipes[pk] for pk in ids if pk in recipes]
+        return paginator.get_paginated_response(RecipeReadSerializer(
+            page, many=True, context={'request': request}).data)
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+    @action(detail=True, methods=['GET'])
+    def similar(self, request, pk=None):
+        """Рецепты, которые добавляли вместе с этим (build_similar_recipes)."""
+        recipe = get_object_or_404(Recipe, pk=pk)
+        neighbours = RecipeSimilarity.objects.filter(
+            recipe=recipe).order_by('-score').select_related(
+                'similar').defer('similar__search_vector')
+        return Response(ShortRecipeSerializer(
+            [neighbour.similar for neighbour in neighbours], many=True,
+            context={'request': request}).data)
+
+    @action(detail=False, methods=['GET'])
+    def pantry(self, request):
+        """Что приготовить из продуктов ?ingredients=1,5,9."""
+        try:
+            ingredient_ids = {
+                int(pk) for pk in
+                request.query_params.get('ingredients', '').split(',')
+            }
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': 'Укажите id ингредиентов через запятую'})
+        paginator = LimitOffsetPagination()
+        page = paginator.paginate_queryset(
+            pantry_index.match(ingredient_ids), request, view=self)
+        recipes = Recipe.objects.defer('search_vector').in_bulk(
+            [pk for pk, _, _ in page])
+        matched = []
+        for pk, coverage, missing in page:
+            # Рецепт могли удалить после построения индекса
+            if pk in recipes:
+                recipe = recipes[pk]
+                recipe.coverage, recipe.missing = coverage, missing
+                matched.append(recipe)
+        return paginator.get_paginated_response(PantryRecipeSerializer(
+            matched, many=True, context={'request': request}).data)
+
+    @action(detail=False, methods=['GET'])
+    def suggest(self, request):
+        # Подсказки для строки поиска: последнее слово может быть недописано
+        return Response(
+            suggest_recipes(request.query_params.get('search', '')))
+
+
+class IngredientViewSet(AsyncReadMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
     pagination_class = None
-    filter_backends = (DjangoFilterBackend, )
-    filterset_fields = ('name',)
+    async_actions = {'list': 'alist'}
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(name))
+        return self.full_list(request, ingredient_index.ensure_fresh())
+
+    async def alist(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            return Response(await ingredient_index.asearch(name))
+        return self.full_list(request, await ingredient_index.aensure_fresh())
 
+    def full_list(self, request, index):
+        # Полный список отдаём с ETag, чтобы клиент не скачивал его повторно
+        etag = index.etag
+        headers = {'ETag': etag}
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers=headers)
+        return Response(index.rows, headers=headers)
 
-class UserViewSet(DjoserUserViewSet):
+
+class UserViewSet(AsyncReadMixin, DjoserUserViewSet):
     serializer_class = UserDetailSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = LimitOffsetOrCursorPagination
+    # username уникален, для ?cursor= достаточно его индекса
+    cursor_ordering = ('username',)
+    async_actions = {'subscriptions': 'asubscriptions'}
 
     def get_permissions(self):
         if self.action in ('me', 'avatar', 'subscribe'):
@@ -171,20 +304,44 @@ class UserViewSet(DjoserUserViewSet):
 
     @action(detail=False, methods=['GET'])
     def subscriptions(self, request):
-        user = request.user
-        # Получаем всех пользователей, на которых подписан текущий пользователь
-        authors = User.objects.filter(authors__user=user)
+        page = self.paginate_queryset(self.get_subscriptions(request))
+        return self.get_paginated_response(
+            self.subscriptions_data(request, page))
+
+    async def asubscriptions(self, request):
+        page = await self.paginator.apaginate_queryset(
+            self.get_subscriptions(request), request, view=self)
+        return self.get_paginated_response(
+            self.subscriptions_data(request, page))
+
+    def get_subscriptions(self, request):
         # Извлекаем параметр ?recipes_limit
         recipes_limit = request.query_params.get('recipes_limit')
-        page = self.paginate_queryset(authors)
-        serializer = UserWithSubscriptionsSerializer(
+        # Превью рецептов: не больше recipes_limit на автора одним запросом
+        recipes = Recipe.objects.order_by('author', 'name', 'id')
+        if recipes_limit and recipes_limit.isdigit():
+            recipes = recipes.annotate(
+                row_number=Window(
+                    RowNumber(),
+                    partition_by=F('author'),
+                    order_by=(F('name').asc(), F('id').asc())
+                )
+            ).filter(row_number__lte=int(recipes_limit))
+        # Получаем всех пользователей, на которых подписан текущий пользователь
+        return User.objects.filter(authors__user=request.user).annotate(
+            is_subscribed=Value(True)
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='preview_recipes')
+        )
+
+    def subscriptions_data(self, request, page):
+        return UserWithSubscriptionsSerializer(
             page, many=True,
             context={
                 'request': request,
-                'recipes_limit': recipes_limit
+                'recipes_limit': request.query_params.get('recipes_limit')
             }
-        )
-        return self.get_paginated_response(serializer.data)
+        ).data
 
     @action(detail=True, methods=['POST', 'DELETE'])
     def subscribe(self, request, id=None):
@@ -216,9 +373,9 @@ class UserViewSet(DjoserUserViewSet):
                 avatar_url = request.build_absolute_uri(
                     user.avatar.url) if user.avatar else None
                 return Response({'avatar': avatar_url})
-        # DELETE
+        # DELETE. Файл может быть общим с другими объектами:
+        # его удалит collect_media_garbage, когда ссылок не останется
         if user.avatar:
-            user.avatar.delete(save=False)
             user.avatar = None
             user.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -37,7 +37,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
+    'api.replicas.replica_middleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -66,6 +68,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+# Корутины для чтения рецептов, ингредиентов, подписок и коротких ссылок
+# (api.async_views); рассчитаны на запуск под ASGI, см. Dockerfile
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'true').lower() == 'true'
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -83,6 +89,30 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения: DB_REPLICA_HOSTS=host1,host2, остальные
+# параметры подключения как у основной БД. Маршрутизация — api.replicas
+DATABASE_REPLICAS = []
+for number, host in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'], 'HOST': host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{number}')
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+# Сколько секунд после записи клиент читает только с основной БД
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
+# Общий для всех процессов кеш (Redis); без REDIS_URL — локальный в процессе
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    } if os.getenv('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -124,6 +154,16 @@ STATIC_ROOT = BASE_DIR / 'static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    # Файлы именуются по хешу содержимого, дубли не записываются
+    'default': {
+        'BACKEND': 'api.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -163,3 +203,61 @@ DJOSER = {
         'current_user': 'api.serializers.UserDetailSerializer',
     }
 }
+
+# Выгрузка списка покупок в PDF
+SHOPPING_LIST_PDF_WORKERS = int(os.getenv('SHOPPING_LIST_PDF_WORKERS', 2))
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Короткие ссылки: LRU-кеш процесса поверх общего кеша
+SHORT_LINK_LOCAL_CACHE_SIZE = 10000
+SHORT_LINK_LOCAL_CACHE_TIMEOUT = 60
+# Сколько помнить, что короткого кода не существует
+SHORT_LINK_MISSING_TIMEOUT = 60
+# Ключ перестановки id в кодах коротких ссылок на рецепты. Не зависит
+# от SECRET_KEY и никогда не меняется: с новым ключом все опубликованные
+# ссылки перестанут открываться
+SHORT_LINK_SECRET = os.getenv('SHORT_LINK_SECRET', 'foodgram-short-links')
+
+# Кеш множеств избранного, корзины и подписок пользователя (алиас CACHES)
+MEMBERSHIP_CACHE = os.getenv('MEMBERSHIP_CACHE', 'default')
+MEMBERSHIP_CACHE_TIMEOUT = 60 * 60 * 24
+# С какого размера фильтр ?is_favorited= и ?is_in_shopping_cart=
+# строится подзапросом, а не списком id из кеша
+MEMBERSHIP_IN_LIST_LIMIT = 500
+
+# Сколько хранить ответы GET /api/recipes/ для анонимов
+RECIPES_RESPONSE_CACHE_TIMEOUT = 60 * 10
+
+# Потоки, строящие уменьшенные копии изображений
+IMAGE_VARIANTS_WORKERS = int(os.getenv('IMAGE_VARIANTS_WORKERS', 2))
+
+# Полнотекстовый поиск рецептов: ранжируются не больше стольких
+# совпадений, подсказок отдаётся не больше стольких
+RECIPE_SEARCH_MAX_RESULTS = 1000
+RECIPE_SUGGESTIONS_LIMIT = 10
+RECIPE_SUGGESTIONS_MIN_LENGTH = 2
+
+# Лента подписок: рецепты авторов, у которых подписчиков больше порога,
+# не раскладываются по лентам при публикации, а подмешиваются при чтении
+FEED_FANOUT_MAX_SUBSCRIBERS = int(
+    os.getenv('FEED_FANOUT_MAX_SUBSCRIBERS', 1000))
+# Сколько последних рецептов автора попадает в ленту при подписке
+FEED_BACKFILL_SIZE = 50
+
+# Сколько похожих рецептов хранить для каждого рецепта
+SIMILAR_RECIPES_TOP_K = 10
+
+# Оценки рецептов для ?ordering=: через сколько дней добавление
+# в избранное или корзину весит вдвое меньше
+RECIPE_SCORE_HALF_LIFE_DAYS = {
+    'popularity_score': 30,
+    'trending_score': 1,
+}
+
+# Метрики запросов (api.metrics): как часто процесс публикует накопленное
+# в общий кеш для /metrics и сколько хранится снимок процесса
+METRICS_FLUSH_SECONDS = 10
+METRICS_SNAPSHOT_TIMEOUT = 60 * 60 * 24
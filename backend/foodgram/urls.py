@@ -3,15 +3,20 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import include, path
 
-from api.views import ShortLinkRedirectView
+from api.views import (
+    AsyncShortLinkRedirectView, MetricsView, ShortLinkRedirectView
+)
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
     path("s/<slug:slug>/",
-         ShortLinkRedirectView.as_view(),
+         (AsyncShortLinkRedirectView if settings.ASYNC_READ_VIEWS
+          else ShortLinkRedirectView).as_view(),
          name="short-link-redirect"),
+    # Для Prometheus; nginx этот путь наружу не проксирует
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
 
 if settings.DEBUG: